@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# The modules of tetris_env import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tetris_env'))
+
+
+@pytest.fixture
+def brain():
+    # weights of a bot that clears lines: completed lines against the
+    # height, holes and roughness of the stack
+    return [1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0]
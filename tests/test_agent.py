@@ -0,0 +1,55 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+import pytest
+
+from env import TetrisEnv
+from agent import Evolution, play_games, play_population
+
+
+@pytest.mark.parametrize('common_seeds', [True, False])
+def test_play_population_matches_play_games(common_seeds):
+    rng = np.random.default_rng(1)
+    brains = rng.uniform(-1, 1, (5, 9))
+    seeds = [[7, 8] if common_seeds else [10 * i, 10 * i + 1] for i in range(len(brains))]
+    scores = play_population(brains, seeds, max_steps=200)
+    tetrisEnv = TetrisEnv()
+    for brain, brainSeeds, score in zip(brains.tolist(), seeds, scores):
+        assert score == play_games(tetrisEnv, brain, brainSeeds[0], num_games=2, max_steps=200)
+
+
+@pytest.mark.parametrize('racing', [False, True])
+def test_lockstep_evolves_the_same_brains(racing):
+    best = []
+    for lockstep in (False, True):
+        random.seed(1)
+        evolution = Evolution(TetrisEnv(), gen_size=4, gen_count=2, num_games=2, max_steps=60,
+                              lockstep=lockstep, racing=racing)
+        fitness = evolution.evaluate_population(evolution.population, 0)
+        assert isinstance(evolution.population, np.ndarray) and evolution.population.shape == (4, 9)
+        with contextlib.redirect_stdout(io.StringIO()):
+            best.append((fitness, evolution.evolve(), evolution.population.tolist()))
+    assert best[0] == best[1]
+
+
+def test_race_survivors_play_every_game():
+    evolution = Evolution(TetrisEnv(), gen_size=8, num_games=16, racing=True, race_games=1)
+    games = [set() for _ in evolution.population]
+    rows = {tuple(brain): i for i, brain in enumerate(evolution.population.tolist())}
+
+    def play_brains(brains, seeds, num_games, pool=None):
+        # brains score their first weight, so the race keeps the same ones
+        for brain, seed in zip(brains.tolist(), seeds):
+            games[rows[tuple(brain)]].update(range(seed, seed + num_games))
+        return [brain[0] for brain in brains.tolist()]
+
+    evolution.play_brains = play_brains
+    fitness = evolution.evaluate_population(evolution.population, 0)
+    seed = evolution.generation_seed(0, 0, 8)
+    finalists = [i for i, rounds in enumerate(evolution.survived) if rounds == max(evolution.survived)]
+    assert len(finalists) == max(2, int(8 * evolution.elitism))
+    for i in finalists:
+        assert games[i] == set(range(seed, seed + 16))
+        assert fitness[i] == evolution.population[i][0]
@@ -0,0 +1,164 @@
+import copy
+import random
+
+import pytest
+
+from gameLogic import *
+from benchmark import makeBoards, makeLineBoards
+from bitboard import BitBoard, toBitBoard, boardArray, boardKey, boardRows, snapshotBoard, restoreBoard
+from zobrist import boardHash
+
+
+def randomPiece(rng, x=None, y=None):
+    shape = rng.choice(list(PIECES))
+    return {'shape': shape, 'rotation': rng.randrange(len(PIECES[shape])),
+            'x': rng.randint(-2, BOARDWIDTH - 1) if x is None else x,
+            'y': rng.randint(-2, BOARDHEIGHT - 2) if y is None else y,
+            'color': SHAPE_INDEX[shape]}
+
+
+def assertSameBoard(board, bitBoard):
+    assert [list(column) for column in bitBoard] == board
+    assert bitBoard.rows == toBitBoard(board).rows
+    assert (bitBoard.cells == boardArray(board)).all()
+
+
+def linesBoards(seed, count):
+    rng = random.Random(seed)
+    boards = makeLineBoards(seed, count)
+    # full lines in the middle of the stack as well
+    for board in boards[:count // 2]:
+        for y in rng.sample(range(BOARDHEIGHT), rng.randint(1, 3)):
+            for x in range(BOARDWIDTH):
+                board[x][y] = rng.randrange(len(COLORS))
+    return boards
+
+
+def test_isValidPosition_matches_list_board():
+    rng = random.Random(1)
+    for board in makeBoards(1, 50):
+        bitBoard = toBitBoard(board)
+        for _ in range(100):
+            piece = randomPiece(rng, x=rng.randint(-8, BOARDWIDTH + 8), y=rng.randint(-6, BOARDHEIGHT + 2))
+            adjX, adjY = rng.randint(-2, 2), rng.randint(-2, 3)
+            assert isValidPosition(bitBoard, piece, adjX, adjY) == isValidPosition(board, piece, adjX, adjY)
+
+
+def test_add_and_remove_pieces_match_list_board():
+    rng = random.Random(2)
+    for board in makeBoards(2, 50):
+        bitBoard = toBitBoard(board)
+        placed = []
+        for _ in range(5):
+            piece = randomPiece(rng, y=0)
+            if isValidPosition(board, piece):
+                piece['y'] = getLandingRow(board, piece)
+                addToBoard(board, piece)
+                addToBoard(bitBoard, piece)
+                placed.append(piece)
+                assertSameBoard(board, bitBoard)
+        for piece in reversed(placed):
+            removeFromBoard(board, piece)
+            removeFromBoard(bitBoard, piece)
+            assertSameBoard(board, bitBoard)
+
+
+def test_overlapping_and_raised_pieces_match_list_board():
+    # pieces written over filled cells, or sticking out above the board,
+    # which only happens once the game is lost
+    rng = random.Random(7)
+    for board in makeBoards(7, 50):
+        bitBoard = toBitBoard(board)
+        for _ in range(3):
+            piece = randomPiece(rng, y=rng.randint(-3, 12))
+            piece['x'] = rng.choice(PIECE_GEOMETRY[piece['shape']][piece['rotation']].spawnRange)
+            addToBoard(board, piece)
+            addToBoard(bitBoard, piece)
+            assertSameBoard(board, bitBoard)
+            assert bitBoard.zobrist == boardHash(board)
+            removeFromBoard(board, piece)
+            removeFromBoard(bitBoard, piece)
+            assertSameBoard(board, bitBoard)
+            assert bitBoard.zobrist == boardHash(board)
+
+
+def test_deepcopy_gets_its_own_cells():
+    bitBoard = toBitBoard(makeBoards(8, 1)[0])
+    copied = copy.deepcopy(bitBoard)
+    piece = {'shape': 'O', 'rotation': 0, 'x': 3, 'y': -1, 'color': 1}
+    piece['y'] = getLandingRow(copied, piece)
+    addToBoard(copied, piece)
+    assert (copied.cells != bitBoard.cells).sum() == 4
+    assert (copied.cells == boardArray([list(column) for column in copied])).all()
+
+
+def test_line_clears_match_list_board():
+    for board in linesBoards(3, 100):
+        bitBoard = toBitBoard(board)
+        for y in range(BOARDHEIGHT):
+            assert isCompleteLine(bitBoard, y) == isCompleteLine(board, y)
+        original = [list(column) for column in board]
+        lines = getCompleteLines(board)
+        assert getCompleteLines(bitBoard) == lines
+        assert removeCompleteLines(bitBoard) == removeCompleteLines(board) == len(lines) > 0
+        assertSameBoard(board, bitBoard)
+        restoreCompleteLines(board, lines)
+        restoreCompleteLines(bitBoard, lines)
+        assert board == original
+        assertSameBoard(board, bitBoard)
+
+
+@pytest.mark.parametrize('backend', [list, toBitBoard])
+def test_boardKey_is_the_same_for_both_backends(backend):
+    rng = random.Random(4)
+    for board in makeBoards(4, 30):
+        expected = tuple(toBitBoard(board).rows)
+        assert boardKey(backend(board)) == expected
+        assert tuple(boardRows(board)) == expected
+        piece = randomPiece(rng, y=0)
+        if isValidPosition(board, piece):
+            piece['y'] = getLandingRow(board, piece)
+            withPiece = [list(column) for column in board]
+            addToBoard(withPiece, piece)
+            assert boardKey(backend(board), piece) == boardKey(withPiece)
+
+
+def test_zobrist_hash_follows_pieces_and_line_clears():
+    rng = random.Random(6)
+    for board in linesBoards(6, 60):
+        bitBoard = toBitBoard(board)
+        assert bitBoard.zobrist == boardHash(board)
+        lines = getCompleteLines(board)
+        removeCompleteLines(board)
+        removeCompleteLines(bitBoard)
+        assert bitBoard.zobrist == boardHash(board)
+        piece = randomPiece(rng, y=0)
+        if isValidPosition(board, piece):
+            piece['y'] = getLandingRow(board, piece)
+            addToBoard(board, piece)
+            addToBoard(bitBoard, piece)
+            assert bitBoard.zobrist == boardHash(board)
+            removeFromBoard(board, piece)
+            removeFromBoard(bitBoard, piece)
+        restoreCompleteLines(board, lines)
+        restoreCompleteLines(bitBoard, lines)
+        assert bitBoard.zobrist == boardHash(board)
+
+
+def test_cells_is_updated_in_place():
+    bitBoard = BitBoard()
+    cells = boardArray(bitBoard)
+    piece = {'shape': 'I', 'rotation': 0, 'x': 3, 'y': 0, 'color': 2}
+    piece['y'] = getLandingRow(bitBoard, piece)
+    addToBoard(bitBoard, piece)
+    assert cells is bitBoard.cells and (cells != 0).sum() == 4
+
+
+@pytest.mark.parametrize('backend', [getBlankBoard, BitBoard])
+def test_snapshotBoard_round_trip(backend):
+    for board in makeBoards(5, 20):
+        data = snapshotBoard(board)
+        restored = backend()
+        restoreBoard(restored, data)
+        assert [list(column) for column in restored] == board
+        assert snapshotBoard(restored) == data
@@ -0,0 +1,170 @@
+import random
+
+import numpy as np
+import pytest
+
+import env
+import tetris_model
+
+from env import TetrisEnv, BOARD_BACKENDS
+from gameLogic import BOARDWIDTH, PIECE_GEOMETRY, countedBoards
+from tetrisAI import boardEval
+from tetris_model import encode_piece, decode_piece
+
+
+def botAction(state, evaluator, plan):
+    # the next primitive action of the heuristic bot, see agent.play_game
+    piece = state.falling_piece
+    if plan.get('piece') is not piece:
+        plan['piece'] = piece
+        plan['target'] = evaluator.returnBestState(piece, state.board)
+    targetX, targetRotation = plan['target']
+    if piece['rotation'] != targetRotation:
+        return 2
+    if piece['x'] < targetX:
+        return 1
+    if piece['x'] > targetX:
+        return 0
+    return 4
+
+
+def playSteps(tetrisEnv, actions):
+    out = []
+    for action in actions:
+        observation, reward, terminated, info = tetrisEnv.step(action)
+        out.append((info['key'], reward, terminated, observation['board'].tobytes(),
+                    observation['falling_piece'].tobytes(), observation['score']))
+        if terminated:
+            break
+    return out
+
+
+@pytest.mark.parametrize('backend', list(BOARD_BACKENDS))
+def test_primitive_reward_counts_cleared_lines(backend, brain):
+    tetrisEnv = TetrisEnv(backend=backend)
+    tetrisEnv.reset(seed=3)
+    evaluator = boardEval(brain)
+    plan = {}
+    clears = 0
+    for _ in range(1500):
+        before = tetrisEnv.state.lines_cleared
+        observation, reward, terminated, info = tetrisEnv.step(botAction(tetrisEnv.state, evaluator, plan))
+        assert reward == (tetrisEnv.state.lines_cleared - before) * 10 - 1
+        clears += reward > 0
+        if terminated:
+            break
+    assert clears
+
+
+def test_placement_reward_counts_cleared_lines(brain):
+    tetrisEnv = TetrisEnv(action_mode='placement')
+    observation, info = tetrisEnv.reset(seed=4)
+    evaluator = boardEval(brain)
+    clears = 0
+    for _ in range(200):
+        piece = tetrisEnv.state.falling_piece
+        targetX, rotation = evaluator.returnBestState(piece, tetrisEnv.state.board)
+        action = rotation * BOARDWIDTH + targetX + PIECE_GEOMETRY[piece['shape']][rotation].minX
+        if not info['action_mask'][action]:
+            action = int(np.flatnonzero(info['action_mask'])[0])
+        before = tetrisEnv.state.lines_cleared
+        observation, reward, terminated, info = tetrisEnv.step(action)
+        assert reward == (tetrisEnv.state.lines_cleared - before) * 10 - 1
+        clears += reward > 0
+        if terminated:
+            break
+    assert clears
+
+
+@pytest.mark.parametrize('backend', list(BOARD_BACKENDS))
+def test_restore_replays_the_same_game(backend):
+    tetrisEnv = TetrisEnv(backend=backend)
+    tetrisEnv.reset(seed=5)
+    rng = random.Random(5)
+    for k in range(20):
+        playSteps(tetrisEnv, [rng.randrange(6) for _ in range(rng.randint(1, 30))])
+        if tetrisEnv.model.GOAL_TEST():
+            tetrisEnv.reset(seed=k)
+        snapshot = tetrisEnv.snapshot()
+        key = tetrisEnv.state.key()
+        actions = [rng.randrange(6) for _ in range(60)]
+        first = playSteps(tetrisEnv, actions)
+        tetrisEnv.restore(snapshot)
+        assert tetrisEnv.state.key() == key
+        assert playSteps(tetrisEnv, actions) == first
+
+
+def test_snapshot_works_across_backends():
+    listEnv = TetrisEnv(backend='list')
+    listEnv.reset(seed=9)
+    playSteps(listEnv, [i % 6 for i in range(150)])
+    bitEnv = TetrisEnv(backend='bitboard')
+    bitEnv.restore(listEnv.snapshot())
+    assert bitEnv.state.key() == listEnv.state.key()
+    assert bitEnv.snapshot() == listEnv.snapshot()
+
+
+@pytest.mark.parametrize('backend', list(BOARD_BACKENDS))
+def test_profiling_only_hooks_the_profiled_env(backend):
+    originals = (tetris_model.TetrisModel.RESULT, env.TetrisEnv.render, env.isValidPosition)
+    profiled = TetrisEnv(backend=backend, profile=True)
+    plain = TetrisEnv(backend=backend)
+    profiled.reset(seed=6)
+    plain.reset(seed=6)
+    for i in range(300):
+        action = i * 7 % 6
+        a = profiled.step(action)
+        b = plain.step(action)
+        assert a[1:3] == b[1:3] and a[3]['key'] == b[3]['key']
+        assert 'profile' in a[3] and 'profile' not in b[3]
+        assert not {'RESULT', 'GOAL_TEST'} & set(vars(profiled.model))
+        if a[2]:
+            profiled.reset(seed=i)
+            plain.reset(seed=i)
+    assert (tetris_model.TetrisModel.RESULT, env.TetrisEnv.render, env.isValidPosition) == originals
+    assert not countedBoards
+    stats = profiled.stats()
+    assert stats['step']['calls'] == 300
+    assert stats['step;RESULT;advance_game_state']['calls'] == 300
+    assert stats['step;GOAL_TEST;isValidPosition']['calls'] == 300
+    assert plain.stats() == {}
+
+
+def test_profiling_times_planners_built_during_the_step():
+    profiled = TetrisEnv(profile=True, beam_width=2)
+    profiled.reset(seed=7)
+    state = profiled.model.RESULT(5)
+    with profiled.profiler:
+        # the planner of a state made in the step, as render() builds it
+        state.gh.newPiece(state.falling_piece, state.board, state.next_piece)
+    stats = profiled.stats()
+    assert stats['step;returnBestState']['calls'] == 1
+    assert stats['step;returnBestStateLookahead']['calls'] == 1
+    assert 'returnBestState' not in vars(profiled.evaluator)
+
+
+def test_board_observation_is_a_view_of_the_board():
+    tetrisEnv = TetrisEnv()
+    observation, info = tetrisEnv.reset(seed=1)
+    assert observation['board'].dtype == np.int8
+    assert np.shares_memory(observation['board'], tetrisEnv.state.board.cells)
+
+
+def test_encoded_pieces_decode():
+    tetrisEnv = TetrisEnv()
+    observation, info = tetrisEnv.reset(seed=2)
+    for i in range(100):
+        assert decode_piece(observation['falling_piece']) == tetrisEnv.state.falling_piece
+        assert decode_piece(encode_piece(tetrisEnv.state.next_piece)) == tetrisEnv.state.next_piece
+        assert observation in tetrisEnv.observation_space
+        observation, reward, terminated, info = tetrisEnv.step(i % 6)
+        if terminated:
+            break
+
+
+def test_beam_width_reaches_the_planner():
+    tetrisEnv = TetrisEnv(beam_width=3)
+    tetrisEnv.reset(seed=1)
+    assert tetrisEnv.state.gh.beamWidth == 3
+    tetrisEnv.step(5)
+    assert tetrisEnv.state.gh.beamWidth == 3
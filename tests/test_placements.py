@@ -0,0 +1,76 @@
+import random
+from collections import deque
+
+from gameLogic import *
+from benchmark import makeBoards
+from bitboard import toBitBoard
+from placements import getReachablePlacements, MOVE_LEFT, MOVE_RIGHT, MOVE_CW, MOVE_CCW, MOVE_DOWN
+
+
+def bruteForcePlacements(board, piece):
+    # (rotation, x, y) of every resting position, by a plain search over
+    # every move with isValidPosition
+    numRotations = len(PIECES[piece['shape']])
+    probe = dict(piece)
+
+    def fits(rotation, x, y):
+        # above the board isValidPosition lets a piece through the walls,
+        # the search keeps it between them
+        probe['rotation'], probe['x'], probe['y'] = rotation, x, y
+        return (isValidPosition(board, probe)
+                and all(0 <= x + cellX < BOARDWIDTH for cellX, cellY in PIECE_GEOMETRY[piece['shape']][rotation].cells))
+
+    start = (piece['rotation'], piece['x'], piece['y'])
+    if not fits(*start):
+        return set()
+    seen = {start}
+    queue = deque([start])
+    resting = set()
+    while queue:
+        rotation, x, y = queue.popleft()
+        if not fits(rotation, x, y + 1):
+            resting.add((rotation, x, y))
+        for move in ((rotation, x - 1, y), (rotation, x + 1, y), ((rotation + 1) % numRotations, x, y),
+                     ((rotation - 1) % numRotations, x, y), (rotation, x, y + 1)):
+            if move not in seen and fits(*move):
+                seen.add(move)
+                queue.append(move)
+    return resting
+
+
+def followPath(board, piece, path):
+    moved = dict(piece)
+    numRotations = len(PIECES[piece['shape']])
+    for move in path:
+        if move == MOVE_LEFT:
+            moved['x'] -= 1
+        elif move == MOVE_RIGHT:
+            moved['x'] += 1
+        elif move == MOVE_CW:
+            moved['rotation'] = (moved['rotation'] + 1) % numRotations
+        elif move == MOVE_CCW:
+            moved['rotation'] = (moved['rotation'] - 1) % numRotations
+        else:
+            assert move == MOVE_DOWN
+            moved['y'] += 1
+        assert isValidPosition(board, moved)
+    return moved
+
+
+def test_reachable_placements_match_brute_force():
+    rng = random.Random(1)
+    for board in makeBoards(1, 150):
+        shape = rng.choice(list(PIECES))
+        piece = {'shape': shape, 'rotation': rng.randrange(len(PIECES[shape])), 'x': 3,
+                 'y': rng.choice([-2, 0]), 'color': SHAPE_INDEX[shape]}
+        for backend in (board, toBitBoard(board)):
+            found = getReachablePlacements(backend, piece)
+            positions = {(placed['rotation'], placed['x'], placed['y']) for placed, path in found}
+            assert len(positions) == len(found)
+            assert positions == bruteForcePlacements(board, piece)
+            assert [placed for placed, path in getReachablePlacements(backend, piece, paths=False)] == \
+                [placed for placed, path in found]
+            for placed, path in found:
+                moved = followPath(board, piece, path)
+                assert (moved['rotation'], moved['x'], moved['y']) == (placed['rotation'], placed['x'], placed['y'])
+                assert not isValidPosition(board, moved, adjY=1)
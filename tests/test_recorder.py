@@ -0,0 +1,40 @@
+import random
+
+import numpy as np
+import pytest
+
+from env import TetrisEnv
+from recorder import TrajectoryRecorder, TrajectoryDataset, RECORD_DTYPE, unpackBoards
+
+
+def test_dataset_returns_what_was_recorded(tmp_path):
+    rng = random.Random(0)
+    expected = []
+    with TrajectoryRecorder(TetrisEnv(), tmp_path, shard_bytes=1000 * RECORD_DTYPE.itemsize) as recorder:
+        observation, info = recorder.reset(seed=3)
+        for i in range(2500):
+            before = ((np.array(observation['board']) != 0).astype(np.uint8),
+                      observation['falling_piece'].copy(), observation['next_piece'].copy())
+            action = rng.randrange(6)
+            observation, reward, terminated, info = recorder.step(action)
+            expected.append(before + (action, reward, terminated))
+            if terminated:
+                observation, info = recorder.reset(seed=i)
+    dataset = TrajectoryDataset(tmp_path)
+    assert len(dataset) == 2500 and len(dataset.shards) == 3
+    for i in [0, 1, 999, 1000, 1001, 2499, -1]:
+        record = dataset[i]
+        board, fallingPiece, nextPiece, action, reward, terminated = expected[i]
+        assert (unpackBoards(record['board']) == board).all()
+        assert (record['falling_piece'] == fallingPiece).all() and (record['next_piece'] == nextPiece).all()
+        assert (record['action'], record['reward'], record['terminated']) == (action, reward, terminated)
+    indices = np.random.default_rng(0).integers(0, 2500, 256)
+    batch = dataset.batch(indices)
+    episodes = np.cumsum([0] + [terminated for *_, terminated in expected])
+    for k, i in enumerate(indices):
+        assert (batch['board'][k] == expected[i][0]).all() and batch['action'][k] == expected[i][3]
+        assert batch['episode'][k] == episodes[i]
+    # records are read only views of the memory mapped shards
+    assert np.shares_memory(dataset.records(0), dataset.shards[0]) and not dataset.records(0).flags.writeable
+    with pytest.raises(IndexError):
+        dataset[2500]
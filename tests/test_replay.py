@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+import pytest
+
+from env import TetrisEnv
+from replay import EpisodeRecorder, EpisodeReplayer, EpisodeLog
+
+
+@pytest.mark.parametrize('action_mode, placement_search', [('primitive', 'straight'),
+                                                           ('placement', 'bfs'),
+                                                           ('placement', 'straight')])
+def test_replayer_seeks_to_every_recorded_step(action_mode, placement_search):
+    rng = random.Random(1)
+    recorder = EpisodeRecorder(TetrisEnv(action_mode=action_mode, placement_search=placement_search),
+                               keyframe_interval=50)
+    observation, info = recorder.reset(seed=7)
+    snapshots = [recorder.unwrapped.snapshot()]
+    rewards = []
+    terminated = False
+    while not terminated:
+        if action_mode == 'primitive':
+            action = rng.choice([0, 1, 2, 3, 4, 5, 5])
+        else:
+            action = rng.choice(np.flatnonzero(info['action_mask']).tolist())
+        observation, reward, terminated, info = recorder.step(action)
+        snapshots.append(recorder.unwrapped.snapshot())
+        rewards.append(reward)
+
+    log = recorder.logs[-1]
+    loaded = EpisodeLog.from_bytes(log.to_bytes())
+    assert (loaded.actions, loaded.keyframes, loaded.seed) == (log.actions, log.keyframes, 7)
+    assert loaded.terminated and len(loaded) == len(rewards)
+
+    replayer = EpisodeReplayer(loaded)
+    steps = list(range(len(snapshots)))
+    rng.shuffle(steps)
+    # backwards and forwards, then every step in order
+    for step in steps + list(range(len(snapshots))):
+        replayer.seek(step)
+        assert replayer.position == step
+        assert replayer.env.snapshot() == snapshots[step]
+    played = [(step, reward, terminated) for step, observation, reward, terminated in replayer.play()]
+    assert [reward for step, reward, terminated in played] == rewards
+    assert played[-1][0] == len(log) and played[-1][2]
+
+    listReplayer = EpisodeReplayer(loaded, TetrisEnv(backend='list', action_mode=action_mode,
+                                                     placement_search=placement_search))
+    listReplayer.seek(len(log))
+    assert listReplayer.env.snapshot() == snapshots[-1]
@@ -0,0 +1,129 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from gameLogic import *
+from benchmark import makeBoards, makeLineBoards, makePieces
+from bitboard import toBitBoard, boardKey
+from tetrisAI import boardEval, featureTracker, featureCache
+
+BACKENDS = [list, toBitBoard]
+FEATURES = ('heights', 'holes', 'colTransitions', 'rowFill', 'rowTransitions', 'rowMasks', 'numCompleteLines')
+
+
+def assertTracks(tracker, board):
+    # the tracker agrees with getBoardState and with a tracker built from scratch
+    assert tracker.getBoardState() == boardEval(None, cache=None).getBoardState(board)
+    fresh = featureTracker(board)
+    for name in FEATURES:
+        assert getattr(tracker, name) == getattr(fresh, name), name
+    assert tracker.key() == boardKey(board)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_search_leaves_the_board_unchanged(backend, brain):
+    evaluator = boardEval(brain, cache=None)
+    for board, piece in zip(makeBoards(4, 30), makePieces(4, 30)):
+        original = copy.deepcopy(board)
+        board = backend(board)
+        evaluator.returnBestState(piece, board)
+        assert [list(column) for column in board] == original
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_tracker_follows_placements_clears_and_undos(backend):
+    rng = random.Random(1)
+    evaluator = boardEval(None, cache=None)
+    for board in makeBoards(1, 60):
+        board = backend(copy.deepcopy(board))
+        tracker = featureTracker(board)
+        assertTracks(tracker, board)
+        undos = []
+        for piece in makePieces(rng.randrange(1000), 6, y=0):
+            piece['x'] = rng.randint(-2, BOARDWIDTH - 1)
+            if not isValidPosition(board, piece):
+                continue
+            landingY, undo = evaluator.simulatePlacement(board, piece, clearLines=True, tracker=tracker)
+            undos.append(undo)
+            assertTracks(tracker, board)
+        for undo in reversed(undos):
+            evaluator.undoPlacement(board, undo, tracker=tracker)
+            assertTracks(tracker, board)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_tracker_shifts_columns_over_any_lines(backend):
+    rng = random.Random(2)
+    boards = makeLineBoards(2, 80)
+    # lines with blank cells above and below them, and at the top of columns
+    for board in boards[:40]:
+        for y in rng.sample(range(BOARDHEIGHT), rng.randint(1, 4)):
+            for x in range(BOARDWIDTH):
+                board[x][y] = rng.randrange(len(COLORS))
+    for board in boards:
+        board = backend(board)
+        tracker = featureTracker(board)
+        lines = getCompleteLines(board)
+        assert tracker.removeCompleteLines() == len(lines)
+        assertTracks(tracker, board)
+        tracker.restoreCompleteLines(lines)
+        assertTracks(tracker, board)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_batched_search_matches_returnBestState(backend):
+    rng = random.Random(3)
+    for board, piece in zip(makeBoards(3, 100), makePieces(3, 100)):
+        evaluator = boardEval([rng.uniform(-1, 1) for _ in range(9)], cache=None)
+        board = backend(board)
+        assert evaluator.returnBestStateBatched(piece, board) == evaluator.returnBestState(piece, board)
+
+
+def test_cached_search_is_the_same_on_both_backends():
+    rng = random.Random(3)
+    for board, piece in zip(makeBoards(3, 100), makePieces(3, 100)):
+        brain = [rng.uniform(-1, 1) for _ in range(9)]
+        evaluator = boardEval(brain, cache=featureCache())
+        expected = boardEval(brain, cache=None).returnBestState(piece, board)
+        assert evaluator.returnBestState(piece, board) == expected
+        misses = evaluator.cache.misses
+        # later searches of the same board are answered from the cache
+        assert evaluator.returnBestState(piece, toBitBoard(board)) == expected
+        assert evaluator.returnBestStateBatched(piece, board) == expected
+        assert evaluator.cache.misses == misses
+
+
+def test_bestPlacements_matches_every_brain():
+    rng = np.random.default_rng(5)
+    brains = rng.uniform(-1, 1, (4, 9))
+    evaluator = boardEval(None, cache=None)
+    for board, piece in zip(makeBoards(5, 30), makePieces(5, 30)):
+        placements, stateVariables = evaluator.getPlacementStates(piece, board)
+        best = evaluator.bestPlacements(placements, stateVariables, brains)
+        for brain, target in zip(brains, best):
+            assert target == boardEval(brain.tolist(), cache=None).returnBestState(piece, board)
+
+
+def test_lookahead_only_beams_placements_that_fit(brain):
+    rng = random.Random(6)
+    evaluator = boardEval(brain, cache=None)
+    checked = 0
+    for board, piece in zip(makeBoards(6, 300), makePieces(6, 300, y=0)):
+        # stacks near the top, where some placements stick out of the board
+        for x in range(BOARDWIDTH):
+            for y in range(rng.randint(1, 4), BOARDHEIGHT):
+                if board[x][y] == BLANK and rng.random() < 0.6:
+                    board[x][y] = 0
+        original = copy.deepcopy(board)
+        placements = evaluator.getPlacements(piece, board)
+        clean = {state for state, placed, fits in placements if fits}
+        best = evaluator.returnBestStateLookahead(piece, piece, board)
+        assert board == original
+        if clean:
+            assert best in clean
+            checked += clean != {state for state, placed, fits in placements}
+        elif placements:
+            assert best == evaluator.returnBestState(piece, board)
+    assert checked
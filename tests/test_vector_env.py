@@ -0,0 +1,44 @@
+import numpy as np
+
+from env import TetrisEnv
+from vector_env import TetrisVectorEnv
+from tetrisAI import boardEval
+from test_env import botAction
+
+
+def test_vector_env_matches_scalar_envs(brain):
+    numEnvs = 4
+    vectorEnv = TetrisVectorEnv(numEnvs)
+    observations, info = vectorEnv.reset(seed=100)
+    envs = [TetrisEnv(backend='list') for _ in range(numEnvs)]
+    for i, tetrisEnv in enumerate(envs):
+        observation, _ = tetrisEnv.reset(seed=100 + i)
+        for key in observation:
+            assert (observations[key][i] == observation[key]).all(), key
+    assert observations.keys() == observation.keys()
+    evaluator = boardEval(brain)
+    plans = [{} for _ in range(numEnvs)]
+    rng = np.random.default_rng(1)
+    playing = set(range(numEnvs))
+    rewarded = 0
+    for _ in range(600):
+        # the bot on most steps, so lines get cleared, and random moves between
+        actions = [botAction(tetrisEnv.state, evaluator, plan) if rng.random() < 0.8 else int(rng.integers(6))
+                   for tetrisEnv, plan in zip(envs, plans)]
+        observations, rewards, terminated, info = vectorEnv.step(actions)
+        assert observations in vectorEnv.observation_space
+        for i in list(playing):
+            observation, reward, done, _ = envs[i].step(actions[i])
+            assert rewards[i] == reward and terminated[i] == done
+            rewarded += reward > 0
+            if done:
+                # the game over piece locks partly above the board, where the
+                # two envs differ: TetrisEnv's addToBoard wraps those cells
+                # around to the bottom rows, the vector env drops them
+                playing.discard(i)
+                continue
+            for key in observation:
+                assert (observations[key][i] == observation[key]).all(), key
+        if not playing:
+            break
+    assert rewarded
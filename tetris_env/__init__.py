@@ -4,3 +4,8 @@ register(
     id='Tetris-v0',
     entry_point='tetris_env.env:TetrisEnv',  # Path to TetrisEnv
 )
+
+register(
+    id='TetrisVector-v0',
+    entry_point='tetris_env.vector_env:TetrisVectorEnv',  # Path to TetrisVectorEnv
+)
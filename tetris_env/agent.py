@@ -1,26 +1,183 @@
+import math
+import multiprocessing
 import random
 import sys
 import time
-import pygame
 from typing import DefaultDict
 from hashlib import new
 
+import numpy as np
+
 from game import Game
 from gameLogic import initPygame
+from tetrisAI import boardEval
+from bitboard import boardKey
 from env import TetrisEnv
+from tetris_model import decode_piece
+
+
+def play_game(env, evaluator, max_steps=5000):
+    """
+    Plays one game in a freshly reset env with the heuristic bot: every new
+    piece is planned with evaluator.returnBestState, then rotated, moved and
+    hard dropped there.
+
+    Returns:
+        int: The final game score.
+    """
+    piece = None
+    for _ in range(max_steps):
+        state = env.state
+        if state.falling_piece is not piece:
+            piece = state.falling_piece
+            target_x, target_rotation = evaluator.returnBestState(piece, state.board)
+        if piece['rotation'] != target_rotation:
+            action = 2  # rotate clockwise
+        elif piece['x'] < target_x:
+            action = 1  # right
+        elif piece['x'] > target_x:
+            action = 0  # left
+        else:
+            action = 4  # hard drop
+        _, _, done, _ = env.step(action)
+        if done:
+            break
+    return env.state.score
+
+
+def play_games(env, brain, seed, num_games=5, max_steps=5000):
+    """
+    Average final score of brain over num_games headless games. Game g is
+    played on env.reset(seed=seed + g), so the result only depends on the
+    arguments.
+    """
+    evaluator = boardEval(brain)
+    total_score = 0
+    for g in range(num_games):
+        env.reset(seed=seed + g)
+        total_score += play_game(env, evaluator, max_steps)
+    return total_score / num_games
+
+
+def play_population(brains, seeds, max_steps=5000, backend='bitboard'):
+    """
+    Plays the games of a whole population in lockstep, each the way
+    play_game would. Whenever games reach a new piece, the placements of
+    every distinct (board, piece) position among them are searched once.
+    The boards those placements leave are stacked, their features computed
+    with one boardEval.getBoardStates call and scored against the weights of
+    every brain with one matrix product; each game then takes the best
+    placement for its own brain.
+
+    Positions are only shared between games dealt the same pieces, so the
+    searches pay off most when brains play the same seeds, as with
+    Evolution's default common_seeds. The scoring is batched either way.
+
+    Args:
+        brains: (P, 9) weights, one row per brain.
+        seeds: (P, G) seeds, the games each brain plays.
+        max_steps (int): Env steps after which a game is cut off.
+        backend (str): Board backend of the envs the games are played in.
+
+    Returns:
+        array: (P,) average final score of every brain, the same as
+        play_games would give for its seeds.
+    """
+    weights = np.asarray(brains, dtype=float)
+    seeds = np.asarray(seeds).reshape(len(weights), -1)
+    owners = np.repeat(np.arange(len(weights)), seeds.shape[1])
+    envs = []
+    for seed in seeds.ravel():
+        env = TetrisEnv(backend=backend)
+        env.reset(seed=int(seed))
+        envs.append(env)
+    evaluator = boardEval(None)  # only searches and computes features, the brains are in weights
+    pieces = [None] * len(envs)
+    targets = [None] * len(envs)
+    active = list(range(len(envs)))
+    for _ in range(max_steps):
+        # games at a new piece, grouped by position
+        positions = {}
+        for i in active:
+            state = envs[i].state
+            if state.falling_piece is not pieces[i]:
+                piece = pieces[i] = state.falling_piece
+                key = (boardKey(state.board), piece['shape'], piece['rotation'], piece['x'], piece['y'])
+                positions.setdefault(key, []).append(i)
+        if positions:
+            # search every position, then score all of their afterstates at once
+            searched = []
+            afterstates = []
+            first = 0
+            for games in positions.values():
+                state = envs[games[0]].state
+                placements = evaluator.getPlacements(state.falling_piece, state.board)
+                searched.append((games, placements, first))
+                if placements:
+                    afterstates.append(evaluator.getAfterstates(state.board, placements))
+                    first += len(placements)
+            if afterstates:
+                stateVariables = evaluator.getBoardStates(np.concatenate(afterstates))
+                scores = stateVariables @ weights.T
+            for games, placements, first in searched:
+                rows = slice(first, first + len(placements))
+                for i in games:
+                    if placements:
+                        brain = owners[i]
+                        targets[i] = evaluator.bestPlacement(placements, stateVariables[rows], scores[rows, brain], weights[brain])
+                    else:
+                        targets[i] = (0, 0)
+
+        still = []
+        for i in active:
+            piece = pieces[i]
+            target_x, target_rotation = targets[i]
+            if piece['rotation'] != target_rotation:
+                action = 2  # rotate clockwise
+            elif piece['x'] < target_x:
+                action = 1  # right
+            elif piece['x'] > target_x:
+                action = 0  # left
+            else:
+                action = 4  # hard drop
+            _, _, done, _ = envs[i].step(action)
+            if not done:
+                still.append(i)
+        active = still
+        if not active:
+            break
+    scores = np.array([env.state.score for env in envs], dtype=float)
+    return scores.reshape(seeds.shape).mean(axis=1)
+
+
+# Every pool worker plays its games in its own headless env
+_worker_env = None
+
+
+def _init_worker(backend):
+    global _worker_env
+    _worker_env = TetrisEnv(backend=backend)
+
+
+def _evaluate_job(job):
+    brain, seed, num_games, max_steps = job
+    return play_games(_worker_env, brain, seed, num_games, max_steps)
 
 
 class Agent:
-    def __init__(self, brain, numGames=1):
-        initPygame()
+    def __init__(self, brain, numGames=1, render=False):
+        # the games are only shown (and pygame only loaded) with render=True
+        if render:
+            initPygame()
         self.brain = brain  # Default brain
+        self.render = render
         self.game = Game()
         self.fitness = self.returnAverageFitness(numGames)
 
     def returnAverageFitness(self, numGames):
         totalFitness = 0.0
         for i in range(numGames):
-            data = self.game.runGame(self.brain, False)
+            data = self.game.runGame(self.brain, False, self.render)
             if data[1] == 0:
                 continue
             else:
@@ -41,7 +198,7 @@ class Agent:
         """
         # Clone the current observation and apply the action to get the new state
         board = observation["board"].copy()
-        piece = observation["falling_piece"].copy()
+        piece = decode_piece(observation["falling_piece"])
         # Apply the action logic (e.g., move piece, rotate, drop)
         if action == 0:  # Move left
             piece["x"] = max(piece["x"] - 1, 0)
@@ -133,49 +290,155 @@ class Agent:
         return best_action
 
 class Evolution:
-    def __init__(self, env, gen_size=15, gen_count=50, elitism=0.2, mutation_rate=0.2):
+    def __init__(self, env, gen_size=15, gen_count=50, elitism=0.2, mutation_rate=0.2,
+                 workers=1, chunksize=1, seed=0, num_games=5, max_steps=5000, lockstep=False,
+                 common_seeds=True, racing=False, race_games=1, race_keep=0.5):
+        """
+        Args:
+            workers (int): Processes evaluating fitness; 1 evaluates in this process with env.
+            chunksize (int): Brains sent to a worker at a time.
+            seed (int): Base seed of the piece sequences used for fitness.
+            num_games (int): Games played per brain and generation, per
+                surviving brain with racing.
+            max_steps (int): Env steps after which a game is cut off.
+            lockstep (bool): Without a pool, play the whole population's games
+                together with play_population instead of brain by brain.
+            common_seeds (bool): Every brain of a generation plays the same
+                piece sequences, so fitness differences come from the brains
+                and not from the pieces they were dealt.
+            racing (bool): Evaluate by successive halving, see race().
+            race_games (int): Games every brain plays in the first round.
+            race_keep (float): Fraction of the brains kept after a round.
+        """
         self.env = env
         self.gen_size = gen_size
         self.gen_count = gen_count
         self.elitism = elitism
         self.mutation_rate = mutation_rate
         self.total_reward = 0
-
-        # Initialize population
-        self.population = [self.random_brain() for _ in range(gen_size)]
+        self.workers = workers
+        self.chunksize = chunksize
+        self.seed = seed
+        self.num_games = num_games
+        self.max_steps = max_steps
+        self.lockstep = lockstep
+        self.common_seeds = common_seeds
+        self.racing = racing
+        self.race_games = race_games
+        self.race_keep = race_keep
+        # games played in all fitness evaluations so far
+        self.games_played = 0
+        # rounds of the last race every brain survived, see race()
+        self.survived = []
+        # own generator for brains, selection and mutation, so they do not
+        # depend on how fitness is evaluated
+        self.random = random.Random(random.getrandbits(64))
+
+        # Initialize population, (gen_size, 9) weights with one row per brain
+        self.population = np.array([self.random_brain() for _ in range(gen_size)])
 
     def random_brain(self):
         """Generate a random brain (list of weights)."""
-        return [random.uniform(-1, 1) for _ in range(9)]
+        return [self.random.uniform(-1, 1) for _ in range(9)]
 
-    def evaluate_fitness(self, brain, num_games=5):
+    def evaluate_fitness(self, brain, num_games=5, seed=0):
         """Evaluate fitness of a brain by running it in the environment."""
-        agent = Agent(brain)
-        total_score = 0
-
-        for _ in range(num_games):
-            observation, _ = self.env.reset()
-            done = False
-            while not done:
-                action = agent.choose_action(observation)
-                observation, reward, done, _ = self.env.step(action)
-                # print("current score: ", reward)
-                total_score += reward
+        return play_games(self.env, brain, seed, num_games, self.max_steps)
 
-        print("total_score: ", agent.game.score)
+    def evaluate_population(self, population, gen, pool=None):
+        """
+        Fitness of every brain of a generation, in population order.
 
-        return total_score / num_games
+        The piece sequences are derived from the base seed and the generation,
+        and without common_seeds also from the brain's index, so the result is
+        the same with or without a pool or lockstep and for any number of
+        workers.
+        """
+        seeds = [self.generation_seed(gen, i, len(population)) for i in range(len(population))]
+        self.survived = [0] * len(population)
+        if self.racing:
+            return self.race(population, seeds, pool)
+        self.games_played += len(population) * self.num_games
+        return self.play_brains(population, seeds, self.num_games, pool)
+
+    def generation_seed(self, gen, i, size):
+        """Seed of the first game of brain i in generation gen."""
+        if self.common_seeds:
+            return self.seed + gen * self.num_games
+        return self.seed + (gen * size + i) * self.num_games
+
+    def play_brains(self, brains, seeds, num_games, pool=None):
+        """Average score of every brain over num_games games from its seed on."""
+        brains = np.asarray(brains)
+        if pool is None and self.lockstep:
+            return play_population(brains, [[seed + g for g in range(num_games)] for seed in seeds],
+                                   self.max_steps, getattr(self.env, 'backend', 'bitboard')).tolist()
+        jobs = [(brain, seed, num_games, self.max_steps) for brain, seed in zip(brains.tolist(), seeds)]
+        if pool is None:
+            return [self.evaluate_fitness(brain, num_games, seed) for brain, seed, num_games, max_steps in jobs]
+        return pool.map(_evaluate_job, jobs, chunksize=self.chunksize)
+
+    def race(self, population, seeds, pool=None):
+        """
+        Successive halving: every brain plays race_games games, the best
+        race_keep of them go on to the next round with twice the games, and
+        so on until the survivors have played num_games. At least as many
+        brains as the elites (and two parents) survive every round; once the
+        field is down to them no more are dropped, but they still play on
+        until num_games.
+
+        A brain's fitness is its average over the games it played; brains
+        that dropped out earlier rank below the survivors of later rounds,
+        see self.survived.
+        """
+        population = np.asarray(population)
+        totals = [0.0] * len(population)
+        counts = [0] * len(population)
+        keep_min = max(2, int(self.gen_size * self.elitism))
+        alive = list(range(len(population)))
+        played = 0
+        games = min(self.race_games, self.num_games)
+        rounds = 0
+        while True:
+            scores = self.play_brains(population[alive], [seeds[i] + played for i in alive],
+                                      games - played, pool)
+            for i, score in zip(alive, scores):
+                totals[i] += score * (games - played)
+                counts[i] = games
+                self.survived[i] = rounds
+            self.games_played += len(alive) * (games - played)
+            if games >= self.num_games:
+                break
+            if len(alive) > keep_min:
+                # the same games for everyone, so totals compare like averages
+                alive.sort(key=lambda i: totals[i], reverse=True)
+                alive = sorted(alive[:max(keep_min, math.ceil(len(alive) * self.race_keep))])
+            played = games
+            games = min(games * 2, self.num_games)
+            rounds += 1
+        return [total / count for total, count in zip(totals, counts)]
 
     def evolve(self):
         """Run the evolutionary process."""
+        pool = None
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                        initargs=(getattr(self.env, 'backend', 'bitboard'),))
+        try:
+            return self._evolve(pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _evolve(self, pool):
         for gen in range(self.gen_count):
             print(f"Generation {gen + 1}/{self.gen_count}")
             # Evaluate fitness for all agents
 
-            fitness_scores = [
-                (brain, self.evaluate_fitness(brain)) for brain in self.population
-            ]
-            fitness_scores.sort(key=lambda x: x[1], reverse=True)
+            fitness = self.evaluate_population(self.population, gen, pool)
+            order = sorted(range(len(self.population)), key=lambda i: (self.survived[i], fitness[i]), reverse=True)
+            fitness_scores = [(self.population[i].tolist(), fitness[i]) for i in order]
 
             # Log the best performance
             print("fitness_scores: ", fitness_scores)
@@ -191,26 +454,26 @@ class Evolution:
             new_population = elites.copy()
             while len(new_population) < self.gen_size:
                 if len(elites) < 2:
-                    parent_a = parent_b = random.choice(elites)
+                    parent_a = parent_b = self.random.choice(elites)
                 else:
-                    parent_a, parent_b = random.sample(elites, 2)
+                    parent_a, parent_b = self.random.sample(elites, 2)
                 child = self.crossover(parent_a, parent_b)
                 child = self.mutate(child)
                 new_population.append(child)
 
-            self.population = new_population
+            self.population = np.array(new_population)
 
         # Return the best brain after evolution
         return fitness_scores[0][0]
 
     def crossover(self, parent_a, parent_b):
         """Crossover two parents to produce a child."""
-        return [random.choice([a, b]) for a, b in zip(parent_a, parent_b)]
+        return [self.random.choice([a, b]) for a, b in zip(parent_a, parent_b)]
 
     def mutate(self, brain):
         """Mutate a brain with a given probability."""
         return [
-            weight + random.uniform(-0.1, 0.1) if random.random() < self.mutation_rate else weight
+            weight + self.random.uniform(-0.1, 0.1) if self.random.random() < self.mutation_rate else weight
             for weight in brain
         ]
 
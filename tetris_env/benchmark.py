@@ -0,0 +1,295 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from gameLogic import *
+from bitboard import toBitBoard
+from tetrisAI import boardEval
+import game
+import env
+
+# Times the engine's hot paths on fixed seeds and fixed board corpora.
+#
+#   python benchmark.py                                run and print the results
+#   python benchmark.py --output results.json          also save them as JSON
+#   python benchmark.py --save-baseline                store them as the baseline
+#   python benchmark.py --baseline                     compare against the baseline
+#
+# Compared against a baseline, every benchmark whose ops/sec dropped by more
+# than the tolerance is a failure and the exit status is 1.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_TOLERANCE = 0.3
+BRAIN = [1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0]
+
+
+def makeBoards(seed, count):
+    # Random list-of-columns boards: stacks of mixed heights, some with holes
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(count):
+        board = getBlankBoard()
+        holes = rng.random() < 0.5
+        for x in range(BOARDWIDTH):
+            height = rng.randint(0, rng.choice([4, 10, 18]))
+            for y in range(BOARDHEIGHT - height, BOARDHEIGHT):
+                if not holes or rng.random() < 0.85:
+                    board[x][y] = rng.randrange(len(COLORS))
+        boards.append(board)
+    return boards
+
+
+def makeLineBoards(seed, count):
+    # Random boards with one to four complete lines at the bottom
+    rng = random.Random(seed)
+    boards = makeBoards(seed, count)
+    for board in boards:
+        for y in range(BOARDHEIGHT - rng.randint(1, 4), BOARDHEIGHT):
+            for x in range(BOARDWIDTH):
+                board[x][y] = rng.randrange(len(COLORS))
+    return boards
+
+
+def makePieces(seed, count, y=-2):
+    generator = PieceGenerator(seed)
+    pieces = []
+    for _ in range(count):
+        piece = generator.getNewPiece()
+        piece['y'] = y
+        pieces.append(piece)
+    return pieces
+
+
+# Every benchmark is a function of the scale (1.0 for the full run) that
+# returns (ops, run, batch): run(i) performs op i, and batch ops are timed
+# together so that the timer does not dominate very short operations.
+
+def benchIsValidPosition(backend):
+    def setup(scale):
+        boards = makeBoards(1, 200)
+        if backend == 'bitboard':
+            boards = [toBitBoard(board) for board in boards]
+        rng = random.Random(2)
+        cases = []
+        for piece in makePieces(3, 1000, y=0):
+            piece['y'] = rng.randint(-2, BOARDHEIGHT - 2)
+            piece['x'] = rng.randint(-2, BOARDWIDTH - 1)
+            cases.append((rng.choice(boards), piece, rng.choice((-1, 0, 1)), rng.choice((0, 1))))
+
+        def run(i):
+            board, piece, adjX, adjY = cases[i % len(cases)]
+            isValidPosition(board, piece, adjX, adjY)
+        return int(200000 * scale), run, 100
+    return setup
+
+
+def benchRemoveCompleteLines(backend):
+    def setup(scale):
+        boards = makeLineBoards(4, 200)
+        if backend == 'bitboard':
+            boards = [toBitBoard(board) for board in boards]
+        # remove and put back the lines, so every op sees the same board
+        lines = [getCompleteLines(board) for board in boards]
+
+        def run(i):
+            board = boards[i % len(boards)]
+            removeCompleteLines(board)
+            restoreCompleteLines(board, lines[i % len(boards)])
+        return int(20000 * scale), run, 10
+    return setup
+
+
+def benchGetBoardState(scale):
+    boards = makeBoards(5, 200)
+    evaluator = boardEval(BRAIN, cache=None)
+
+    def run(i):
+        evaluator.getBoardState(boards[i % len(boards)])
+    return int(5000 * scale), run, 10
+
+
+def benchReturnBestState(backend):
+    def setup(scale):
+        boards = makeBoards(6, 100)
+        if backend == 'bitboard':
+            boards = [toBitBoard(board) for board in boards]
+        pieces = makePieces(7, 100)
+        # no feature cache, so repeated boards cost the same every time
+        evaluator = boardEval(BRAIN, cache=None)
+
+        def run(i):
+            evaluator.returnBestState(pieces[i % len(pieces)], boards[i % len(boards)])
+        return int(1000 * scale), run, 1
+    return setup
+
+
+def benchEnvReset(scale):
+    tetrisEnv = env.TetrisEnv()
+
+    def run(i):
+        tetrisEnv.reset(seed=i)
+    return int(5000 * scale), run, 10
+
+
+def benchEnvStep(scale):
+    tetrisEnv = env.TetrisEnv()
+    tetrisEnv.reset(seed=0)
+    rng = random.Random(8)
+    actions = [rng.randrange(6) for _ in range(1000)]
+
+    def run(i):
+        observation, reward, terminated, info = tetrisEnv.step(actions[i % len(actions)])
+        if terminated:
+            tetrisEnv.reset(seed=i)
+    return int(50000 * scale), run, 10
+
+
+def benchRunGame(scale):
+    def run(i):
+        defaultGenerator.seed(i)
+        game.Game().runGame(BRAIN, delay=0, render=False)
+    return max(1, int(5 * scale)), run, 1
+
+
+BENCHMARKS = {
+    'isValidPosition[list]': benchIsValidPosition('list'),
+    'isValidPosition[bitboard]': benchIsValidPosition('bitboard'),
+    'removeCompleteLines[list]': benchRemoveCompleteLines('list'),
+    'removeCompleteLines[bitboard]': benchRemoveCompleteLines('bitboard'),
+    'getBoardState': benchGetBoardState,
+    'returnBestState[list]': benchReturnBestState('list'),
+    'returnBestState[bitboard]': benchReturnBestState('bitboard'),
+    'TetrisEnv.reset': benchEnvReset,
+    'TetrisEnv.step': benchEnvStep,
+    'Game.runGame': benchRunGame,
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def runBenchmark(setup, scale=1.0):
+    """
+    Times one benchmark.
+
+    Args:
+        setup: One of the BENCHMARKS values.
+        scale (float): Fraction of the full number of ops to run.
+
+    Returns:
+        dict: ops, ops_per_sec, p50_us and p99_us latency of one op, and
+              peak_kb, the peak memory allocated while running ops.
+    """
+    ops, run, batch = setup(scale)
+    ops = max(ops, batch)
+    latencies = []
+    # the game engine prints every placement, keep that out of the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for start in range(0, ops - batch + 1, batch):
+            began = time.perf_counter()
+            for i in range(start, start + batch):
+                run(i)
+            latencies.append((time.perf_counter() - began) / batch)
+
+        # a shorter second pass under tracemalloc, which slows everything down
+        ops, run, batch = setup(scale)
+        tracemalloc.start()
+        try:
+            for i in range(max(batch, min(ops, 10 * batch))):
+                run(i)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    total = sum(latencies) * batch
+    return {
+        'ops': len(latencies) * batch,
+        'ops_per_sec': len(latencies) * batch / total,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'peak_kb': peak / 1024,
+    }
+
+
+def runBenchmarks(names=None, scale=1.0, log=None):
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = runBenchmark(BENCHMARKS[name], scale)
+        if log is not None:
+            log(formatResult(name, results[name]))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'benchmarks': results,
+    }
+
+
+def compareResults(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares results against a baseline run.
+
+    Returns:
+        list: (name, ratio, failed) for every benchmark in both runs. ratio
+              is current ops/sec over the baseline's; a benchmark fails when
+              it is below 1 - tolerance.
+    """
+    comparison = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        ratio = result['ops_per_sec'] / baseline['benchmarks'][name]['ops_per_sec']
+        comparison.append((name, ratio, ratio < 1 - tolerance))
+    return comparison
+
+
+def formatResult(name, result):
+    return '%-30s %12.0f ops/s  p50 %10.1f us  p99 %10.1f us  peak %8.1f KB' % (
+        name, result['ops_per_sec'], result['p50_us'], result['p99_us'], result['peak_kb'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Tetris engine hot paths.')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the full number of ops to run')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='compare against this JSON file (default: %(const)s)')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='store the results as the baseline (default: %(const)s)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed drop in ops/sec before a benchmark fails (default: %(default)s)')
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %r' % name)
+
+    results = runBenchmarks(args.names, args.scale, log=print)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = False
+        print()
+        for name, ratio, slower in compareResults(results, baseline, args.tolerance):
+            print('%-30s %6.2fx baseline%s' % (name, ratio, '  SLOWER' if slower else ''))
+            failed = failed or slower
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,383 @@
+import struct
+
+import numpy as np
+
+from gameLogic import BOARDWIDTH, BOARDHEIGHT, BLANK, COLORS, PIECE_GEOMETRY, TEMPLATEWIDTH, TEMPLATEHEIGHT
+from zobrist import CELL_KEYS, ROW_HALF, ROW_KEYS, boardHash, rowHash
+
+# Each board row is stored as an integer bitmask. Bit (WALL + x) is set when
+# column x of that row is filled. The bits to the left and right of the
+# playfield are always set, so a piece that sticks out of the board collides
+# with a "wall" just like it would with a block.
+WALL = 5
+RIGHTWALL = 15
+LEFT_WALL_MASK = (1 << WALL) - 1
+RIGHT_WALL_MASK = ((1 << RIGHTWALL) - 1) << (WALL + BOARDWIDTH)
+EMPTY_ROW = LEFT_WALL_MASK | RIGHT_WALL_MASK
+ROW_BITS = (1 << BOARDWIDTH) - 1
+FULL_ROW = EMPTY_ROW | (ROW_BITS << WALL)
+MAX_SHIFT = WALL + BOARDWIDTH + RIGHTWALL - TEMPLATEWIDTH
+
+
+def compileRowMasks(geometry):
+    # Turn the filled cells of a piece into a tuple of (templateRow, rowMask)
+    # pairs, one for every template row that has at least one filled cell.
+    rowMasks = {}
+    for x, y in geometry.cells:
+        rowMasks[y] = rowMasks.get(y, 0) | (1 << x)
+    return tuple(sorted(rowMasks.items()))
+
+
+PIECE_ROW_MASKS = {shape: [compileRowMasks(geometry) for geometry in PIECE_GEOMETRY[shape]] for shape in PIECE_GEOMETRY}
+# the row masks already shifted to every x a piece can have within the walls,
+# indexed by piece['x'] + WALL
+PIECE_SHIFTED_MASKS = {shape: [[tuple((ty, mask << shift) for ty, mask in rowMasks) for shift in range(MAX_SHIFT + 1)]
+                               for rowMasks in PIECE_ROW_MASKS[shape]] for shape in PIECE_ROW_MASKS}
+# (x, y, offset) for every cell of a piece, offset being where the cell lies
+# in BitBoard.flat relative to the piece's (x, y)
+PIECE_CELL_OFFSETS = {shape: [tuple((x, y, x * BOARDHEIGHT + y) for x, y in geometry.cells) for geometry in PIECE_GEOMETRY[shape]]
+                      for shape in PIECE_GEOMETRY}
+
+
+def compilePlacementKeys(geometry):
+    # Zobrist hash of the cells of a piece at every piece['x'] + TEMPLATEWIDTH
+    # and piece['y'] + TEMPLATEHEIGHT, 0 where the piece leaves the board.
+    # Cells above the board wrap around to its bottom rows, as in addToBoard.
+    keys = []
+    for px in range(-TEMPLATEWIDTH, BOARDWIDTH):
+        column = []
+        for py in range(-TEMPLATEHEIGHT, BOARDHEIGHT):
+            key = 0
+            for x, y in geometry.cells:
+                if not 0 <= px + x < BOARDWIDTH or py + y >= BOARDHEIGHT:
+                    key = 0
+                    break
+                key ^= CELL_KEYS[px + x][py + y]
+            column.append(key)
+        keys.append(column)
+    return keys
+
+
+PLACEMENT_KEYS = {shape: [compilePlacementKeys(geometry) for geometry in PIECE_GEOMETRY[shape]] for shape in PIECE_GEOMETRY}
+
+HALF_BITS = (1 << ROW_HALF) - 1
+FULL_ROW_KEYS = [rowHash(y, ROW_BITS) for y in range(BOARDHEIGHT)]
+
+
+def flatView(cells):
+    # Writable 1-d view of a cells array, cell (x, y) at x * BOARDHEIGHT + y.
+    # Writing single cells through it is much cheaper than indexing numpy.
+    return memoryview(cells).cast('B').cast('b')
+
+
+class BitBoard:
+    """
+    Board backend that keeps every row as an integer bitmask.
+
+    Collision tests, line checks and line clears work on the row masks. The
+    per-cell colors are still kept as a list of columns so that code which
+    reads board[x][y] (drawing, board evaluation, observations) keeps working.
+    cells is a third view: a (BOARDWIDTH, BOARDHEIGHT) int8 array holding 0
+    for a blank cell and color + 1 for a filled one. It is updated in place,
+    so views of it always show the current board; flat is a 1-d view of it
+    (see flatView). Cells must only be written through addToBoard and
+    removeCompleteLines so that all views stay in sync.
+    zobrist holds the Zobrist hash of the filled cells (see zobrist.py) and
+    is updated along with them.
+    """
+
+    def __init__(self):
+        self.rows = [EMPTY_ROW] * BOARDHEIGHT
+        self.columns = [[BLANK] * BOARDHEIGHT for _ in range(BOARDWIDTH)]
+        self.cells = np.zeros((BOARDWIDTH, BOARDHEIGHT), dtype=np.int8)
+        self.flat = flatView(self.cells)
+        self.zobrist = 0
+
+    def __getitem__(self, x):
+        return self.columns[x]
+
+    def __len__(self):
+        return BOARDWIDTH
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __getstate__(self):
+        # the flat view is rebuilt by __setstate__, memoryviews do not copy
+        state = self.__dict__.copy()
+        del state['flat']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.flat = flatView(self.cells)
+
+    def isValidPosition(self, piece, adjX=0, adjY=0):
+        # Return True if the piece is within the board and not colliding
+        shift = piece['x'] + adjX + WALL
+        top = piece['y'] + adjY
+        if 0 <= shift <= MAX_SHIFT:
+            rows = self.rows
+            for ty, mask in PIECE_SHIFTED_MASKS[piece['shape']][piece['rotation']][shift]:
+                y = top + ty
+                if y < 0:
+                    continue  # cells above the board never collide
+                if y >= BOARDHEIGHT or rows[y] & mask:
+                    return False
+            return True
+        # The piece lies completely outside of the walls, so it is only
+        # valid while all of its cells are still above the board.
+        for ty, mask in PIECE_ROW_MASKS[piece['shape']][piece['rotation']]:
+            if top + ty >= 0:
+                return False
+        return True
+
+    def addToBoard(self, piece):
+        # fill in the board based on piece's location, shape, and rotation
+        rows = self.rows
+        px = piece['x']
+        py = piece['y']
+        shape = piece['shape']
+        rotation = piece['rotation']
+        zobrist = self.zobrist ^ PLACEMENT_KEYS[shape][rotation][px + TEMPLATEWIDTH][py + TEMPLATEHEIGHT]
+        for ty, mask in PIECE_SHIFTED_MASKS[shape][rotation][px + WALL]:
+            row = rows[py + ty]
+            if row & mask:
+                # cells that were filled already stay in the hash
+                zobrist ^= rowHash(py + ty, (row & mask) >> WALL)
+            rows[py + ty] = row | mask
+        self.zobrist = zobrist
+        self.writeCells(piece, piece['color'], piece['color'] + 1)
+
+    def removeFromBoard(self, piece):
+        # undo addToBoard: blank the cells covered by the piece
+        rows = self.rows
+        px = piece['x']
+        py = piece['y']
+        shape = piece['shape']
+        rotation = piece['rotation']
+        zobrist = self.zobrist ^ PLACEMENT_KEYS[shape][rotation][px + TEMPLATEWIDTH][py + TEMPLATEHEIGHT]
+        for ty, mask in PIECE_SHIFTED_MASKS[shape][rotation][px + WALL]:
+            row = rows[py + ty]
+            if row & mask != mask:
+                # cells that were blank already stay out of the hash
+                zobrist ^= rowHash(py + ty, (mask & ~row) >> WALL)
+            rows[py + ty] = row & ~mask
+        self.zobrist = zobrist
+        self.writeCells(piece, BLANK, 0)
+
+    def writeCells(self, piece, color, code):
+        # set the columns and cells covered by the piece to color and its code
+        columns = self.columns
+        px = piece['x']
+        py = piece['y']
+        geometry = PIECE_GEOMETRY[piece['shape']][piece['rotation']]
+        if py + geometry.minY >= 0:
+            flat = self.flat
+            base = px * BOARDHEIGHT + py
+            for x, y, offset in PIECE_CELL_OFFSETS[piece['shape']][piece['rotation']]:
+                columns[px + x][py + y] = color
+                flat[base + offset] = code
+        else:
+            # cells above the board wrap around to its bottom rows, as they
+            # do on a list board
+            cells = self.cells
+            for x, y in geometry.cells:
+                columns[px + x][py + y] = color
+                cells[px + x, py + y] = code
+
+    def isCompleteLine(self, y):
+        return self.rows[y] == FULL_ROW
+
+    def getCompleteLines(self):
+        # gameLogic.getCompleteLines, finding the lines from the row masks
+        rows = self.rows
+        if FULL_ROW not in rows:
+            return []
+        columns = self.columns
+        return [(y, [column[y] for column in columns]) for y in range(BOARDHEIGHT) if rows[y] == FULL_ROW]
+
+    def removeCompleteLines(self):
+        # Drop every full row and pad the top of the board with empty rows.
+        rows = self.rows
+        if FULL_ROW not in rows:
+            return 0
+        completeRows = [y for y in range(BOARDHEIGHT) if rows[y] == FULL_ROW]
+        numLinesRemoved = len(completeRows)
+        self.zobrist ^= lineClearHash(rows)
+        self.rows = [EMPTY_ROW] * numLinesRemoved + [row for row in rows if row != FULL_ROW]
+        blank = [BLANK] * numLinesRemoved
+        for column in self.columns:
+            for y in reversed(completeRows):
+                del column[y]
+            column[0:0] = blank
+        # Move the cells down a block of kept rows at a time, starting at
+        # the bottom, so every block lands on rows that were already moved.
+        cells = self.cells
+        end = bottom = BOARDHEIGHT
+        for first, last in reversed(lineRuns(completeRows)):
+            kept = end - last - 1
+            if bottom != end:
+                cells[:, bottom - kept:bottom] = cells[:, last + 1:end]
+            bottom -= kept
+            end = first
+        cells[:, bottom - end:bottom] = cells[:, :end]
+        cells[:, :numLinesRemoved] = 0
+        return numLinesRemoved
+
+    def restoreCompleteLines(self, lines):
+        # undo removeCompleteLines, see gameLogic.getCompleteLines
+        numLines = len(lines)
+        rows = self.rows[numLines:]
+        for y, colors in lines:
+            rows.insert(y, FULL_ROW)
+        self.rows = rows
+        for x, column in enumerate(self.columns):
+            del column[:numLines]
+            for y, colors in lines:
+                column.insert(y, colors[x])
+        # the reverse of removeCompleteLines, moving the blocks of kept rows
+        # up starting at the top
+        cells = self.cells
+        start = numLines
+        top = 0
+        for first, last in lineRuns([y for y, colors in lines]):
+            cells[:, top:first] = cells[:, start:start + first - top]
+            start += first - top
+            top = last + 1
+        flat = self.flat
+        for y, colors in lines:
+            for x in range(BOARDWIDTH):
+                flat[x * BOARDHEIGHT + y] = colors[x] + 1
+        self.zobrist ^= lineClearHash(rows)
+
+
+def lineRuns(lineRows):
+    # [first, last] of every run of adjacent rows in the sorted lineRows
+    runs = []
+    for y in lineRows:
+        if runs and runs[-1][1] == y - 1:
+            runs[-1][1] = y
+        else:
+            runs.append([y, y])
+    return runs
+
+
+def lineClearHash(rows):
+    # What clearing the full rows of these row masks changes in the Zobrist
+    # hash: the cells of the full rows go, and every row above them moves
+    # down by the number of full rows below it. XORing it in again undoes
+    # the clear, so restoring the lines uses the same value.
+    h = 0
+    shift = 0
+    for y in range(BOARDHEIGHT - 1, -1, -1):
+        row = rows[y]
+        if row == FULL_ROW:
+            h ^= FULL_ROW_KEYS[y]
+            shift += 1
+        elif shift and row != EMPTY_ROW:
+            # rowHash of the row at y and at y + shift, inlined
+            bits = (row >> WALL) & ROW_BITS
+            low = bits & HALF_BITS
+            high = bits >> ROW_HALF
+            halves = ROW_KEYS[y]
+            movedHalves = ROW_KEYS[y + shift]
+            h ^= halves[0][low] ^ halves[1][high] ^ movedHalves[0][low] ^ movedHalves[1][high]
+    return h
+
+
+def getBlankBitBoard():
+    # create and return a new blank bitboard
+    return BitBoard()
+
+
+def toBitBoard(board):
+    # build a bitboard holding the same cells as a list-of-lists board
+    bitBoard = BitBoard()
+    for x in range(BOARDWIDTH):
+        for y in range(BOARDHEIGHT):
+            if board[x][y] != BLANK:
+                bitBoard.rows[y] |= 1 << (x + WALL)
+                bitBoard.columns[x][y] = board[x][y]
+                bitBoard.cells[x, y] = board[x][y] + 1
+    bitBoard.zobrist = boardHash(board)
+    return bitBoard
+
+
+def boardArray(board):
+    # (BOARDWIDTH, BOARDHEIGHT) int8 array of the cells of a board of either
+    # backend, 0 for blank and color + 1 for filled. For a BitBoard this is
+    # its own cells buffer, not a copy.
+    if board.__class__ is BitBoard:
+        return board.cells
+    return np.array([[0 if cell == BLANK else cell + 1 for cell in column] for column in board], dtype=np.int8)
+
+
+def boardRows(board):
+    # Row masks of a board of either backend, as in BitBoard.rows. For a
+    # BitBoard these are its own rows, not a copy.
+    if board.__class__ is BitBoard:
+        return board.rows
+    rows = [EMPTY_ROW] * BOARDHEIGHT
+    for x in range(BOARDWIDTH):
+        bit = 1 << (x + WALL)
+        column = board[x]
+        for y in range(BOARDHEIGHT):
+            if column[y] != BLANK:
+                rows[y] |= bit
+    return rows
+
+
+def rowsKey(rows, piece=None):
+    # boardKey of the board with these row masks. A search that keys many
+    # placements on one board computes the rows once and passes them here.
+    if piece is not None:
+        rows = list(rows)
+        shift = piece['x'] + WALL
+        for ty, mask in PIECE_ROW_MASKS[piece['shape']][piece['rotation']]:
+            rows[piece['y'] + ty] |= mask << shift
+    return tuple(rows)
+
+
+def boardKey(board, piece=None):
+    # Compact hashable key for the filled cells of a board of either backend,
+    # with piece added to it if given. Colors are not part of the key.
+    return rowsKey(boardRows(board), piece)
+
+
+# Board snapshots: the row masks and Zobrist hash, followed by the cells
+# array (see BitBoard.cells) as BOARDWIDTH * BOARDHEIGHT bytes
+BOARD_STRUCT = struct.Struct('<%dIQ' % BOARDHEIGHT)
+BOARD_SNAPSHOT_SIZE = BOARD_STRUCT.size + BOARDWIDTH * BOARDHEIGHT
+CELL_COLORS = [BLANK] + list(range(len(COLORS)))  # color for every cell code
+# Colors of the columns restored so far, keyed by their cell bytes. Boards
+# share most of their columns, so this saves decoding them cell by cell.
+COLUMN_COLORS = {}
+COLUMN_CACHE_SIZE = 1 << 16
+
+
+def snapshotBoard(board):
+    # bytes holding every cell of a board of either backend
+    if board.__class__ is not BitBoard:
+        board = toBitBoard(board)
+    return BOARD_STRUCT.pack(*board.rows, board.zobrist) + board.cells.tobytes()
+
+
+def restoreBoard(board, data):
+    # Write a snapshotBoard() blob back into a board of either backend. The
+    # board is changed in place, so views of BitBoard.cells stay valid.
+    cells = bytes(memoryview(data)[BOARD_STRUCT.size:BOARD_SNAPSHOT_SIZE])
+    columns = board.columns if board.__class__ is BitBoard else board
+    for x in range(BOARDWIDTH):
+        codes = cells[x * BOARDHEIGHT:(x + 1) * BOARDHEIGHT]
+        colors = COLUMN_COLORS.get(codes)
+        if colors is None:
+            if len(COLUMN_COLORS) >= COLUMN_CACHE_SIZE:
+                COLUMN_COLORS.clear()
+            colors = COLUMN_COLORS[codes] = [CELL_COLORS[code] for code in codes]
+        columns[x][:] = colors
+    if board.__class__ is BitBoard:
+        values = BOARD_STRUCT.unpack_from(data)
+        board.rows = list(values[:BOARDHEIGHT])
+        board.zobrist = values[BOARDHEIGHT]
+        board.cells[:] = np.frombuffer(cells, dtype=np.int8).reshape(BOARDWIDTH, BOARDHEIGHT)
@@ -1,22 +1,95 @@
+import struct
 import time
 
 import gym
 import numpy as np
-import pygame
 from gym import spaces
 
-from gameLogic import getBlankBoard, getNewPiece, isValidPosition, removeCompleteLines
+from gameLogic import getBlankBoard, getNewPiece, isValidPosition, removeCompleteLines, PieceGenerator, ensureDisplay, BoardRenderer, countedBoards
 from tetris_model import *
+from bitboard import getBlankBitBoard, boardArray, snapshotBoard, restoreBoard
+from frames import getBoardCells, renderBoards
+from placements import getReachablePlacements
+from instrumentation import StepProfiler
+
+# Board representations the environment can run on:
+# - 'list': the original list of columns holding BLANK or a color index
+# - 'bitboard': rows stored as integer bitmasks, see bitboard.py
+BOARD_BACKENDS = {
+    'list': getBlankBoard,
+    'bitboard': getBlankBitBoard,
+}
+
+# Header of a TetrisEnv.snapshot(): falling and next piece (shape index,
+# rotation, x, y), score, level, lines, fall frequency, the generator's
+# random state, then the number of pieces left in its bag and their shape
+# indices. The board follows, see bitboard.snapshotBoard.
+SNAPSHOT_STRUCT = struct.Struct('<8b3qdQB%ds' % len(PIECES))
+SHAPES = list(PIECES)
+
+# Placement actions (action_mode='placement'): action rotation * BOARDWIDTH +
+# column puts the piece in that rotation with its leftmost cell in that
+# column. PLACEMENT_X[shape][action] is the piece x an action stands for, None
+# for the actions that do not exist for the shape.
+NUM_PLACEMENTS = 4 * BOARDWIDTH
+PLACEMENT_X = {}
+for shape in PIECES:
+    PLACEMENT_X[shape] = [None] * NUM_PLACEMENTS
+    for rotation, geometry in enumerate(PIECE_GEOMETRY[shape]):
+        for x in geometry.spawnRange:
+            PLACEMENT_X[shape][rotation * BOARDWIDTH + x + geometry.minX] = x
+ACTION_MODES = ('primitive', 'placement')
+# How action_mask() finds the reachable placements: 'straight' moves the piece
+# one column per row it falls and drops it, 'bfs' searches every move sequence
+# (see placements.py), which adds slides and tucks under overhangs.
+PLACEMENT_SEARCHES = ('straight', 'bfs')
 
 
 class TetrisEnv(gym.Env):
-    def __init__(self):
+    metadata = {"render_modes": ["human", "rgb_array"]}
+
+    def __init__(self, backend='bitboard', render_mode=None, action_mode='primitive', placement_search='straight', profile=False, beam_width=0):
         """
         Initializes the Tetris environment for Gymnasium.
         - Initializes the Tetris model (board, pieces, etc.)
         - Sets up the action and observation spaces for the agent.
+
+        Args:
+            backend (str): Board representation to use, one of BOARD_BACKENDS.
+            render_mode (str, optional): 'human' to draw every step in the
+                pygame window, or 'rgb_array' for render() to return frames.
+            action_mode (str): 'primitive' for one move per step, or
+                'placement' to choose where the piece lands, see place().
+            placement_search (str): One of PLACEMENT_SEARCHES, the placements
+                the placement action mode can reach.
+            profile (bool): Time the phases of every step, see stats().
+            beam_width (int): With more than 0, the built-in bot that plays
+                in 'human' mode plans with the next piece too, looking past
+                that many placements, see boardEval.returnBestStateLookahead.
         """
         super(TetrisEnv, self).__init__()
+        if backend not in BOARD_BACKENDS:
+            raise ValueError(f"Unknown board backend '{backend}', expected one of {list(BOARD_BACKENDS)}")
+        if render_mode is not None and render_mode not in self.metadata["render_modes"]:
+            raise ValueError(f"Unknown render mode '{render_mode}', expected one of {self.metadata['render_modes']}")
+        if action_mode not in ACTION_MODES:
+            raise ValueError(f"Unknown action mode '{action_mode}', expected one of {list(ACTION_MODES)}")
+        if placement_search not in PLACEMENT_SEARCHES:
+            raise ValueError(f"Unknown placement search '{placement_search}', expected one of {list(PLACEMENT_SEARCHES)}")
+        self.backend = backend
+        self.render_mode = render_mode
+        self.action_mode = action_mode
+        self.placement_search = placement_search
+        self.beam_width = beam_width
+        # one evaluator for the planners of all the env's states, whichever
+        # state builds its planner, see State.gh
+        self.evaluator = boardEval(PLANNER_BRAIN)
+        self._mask_state = None  # the state action_mask() was last computed for
+        self.profiler = None
+        if profile:
+            self.profiler = StepProfiler(self._profiled_calls, self._counted_calls)
+            # only a profiled env takes the detour, step() itself is unchanged
+            self.step = self._profiled_step
 
         # Initialize the Tetris game model
         self.clock = None
@@ -25,35 +98,34 @@ class TetrisEnv(gym.Env):
         # Mapping actions to discrete values:
         # 0: left, 1: right, 2: rotate, 3: drop
         self.action_space = spaces.Discrete(6)
-        self.board = getBlankBoard()
-        self.falling_piece = getNewPiece()
-        self.next_piece = getNewPiece()
+        if action_mode == 'placement':
+            # rotation * BOARDWIDTH + leftmost column, see PLACEMENT_X
+            self.action_space = spaces.Discrete(NUM_PLACEMENTS)
+        self.board = BOARD_BACKENDS[backend]()
+        # every env deals its own pieces, seeded through reset(seed=...)
+        self.generator = PieceGenerator()
+        self.falling_piece = getNewPiece(self.generator)
+        self.next_piece = getNewPiece(self.generator)
         self.level = 0
         self.score = 0
         self.lines = 0
         self.reward = 0
         # Define observation space: The observation consists of the board and related game state
         self.observation_space = spaces.Dict({
-            "board": spaces.Box(low=0, high=1, shape=(10, 20), dtype=np.int8),  # 10x20 grid for the board
-            "falling_piece": spaces.Dict({
-                "shape": spaces.Discrete(7),  # 7 possible shapes
-                "rotation": spaces.Discrete(4),  # 4 possible rotations
-                "x": spaces.Discrete(10),  # X position on the board
-                "y": spaces.Discrete(20),  # Y position on the board
-            }),
-            "next_piece": spaces.Dict({
-                "shape": spaces.Discrete(7),
-                "rotation": spaces.Discrete(4),
-                "x": spaces.Discrete(10),
-                "y": spaces.Discrete(20),
-            }),
+            # 10x20 grid for the board, indexed [x, y]: 0 for an empty cell, color + 1 for a filled one
+            "board": spaces.Box(low=0, high=len(PIECES), shape=(BOARDWIDTH, BOARDHEIGHT), dtype=np.int8),
+            # shape (0-6, see SHAPE_INDEX), rotation, x and y of the piece, see encode_piece
+            "falling_piece": spaces.Box(low=-TEMPLATEWIDTH, high=BOARDHEIGHT, shape=(4,), dtype=np.int8),
+            "next_piece": spaces.Box(low=-TEMPLATEWIDTH, high=BOARDHEIGHT, shape=(4,), dtype=np.int8),
             "score": spaces.Discrete(10000),  # Arbitrary large number to handle scores
             "level": spaces.Discrete(10),  # Arbitrary max level
             "lines": spaces.Discrete(100),  # Arbitrary max lines cleared
         })
         self.last_fall_time = time.time()
+        # redraws only what changed between frames in 'human' mode
+        self.renderer = BoardRenderer()
         # Initialize state with the model
-        self.state = State(self.board, self.falling_piece, self.next_piece, self.score, self.level, self.lines)
+        self.state = State(self.board, self.falling_piece, self.next_piece, self.score, self.level, self.lines, self.generator, self.beam_width, self.evaluator)
         # Re-initialize the Tetris game model (this resets the game state)
         self.model = TetrisModel(self.state)
 
@@ -70,15 +142,26 @@ class TetrisEnv(gym.Env):
         """
         # Set the random seed for reproducibility if provided
         super().reset(seed=seed)
-        self.state = State(self.board, self.falling_piece, self.next_piece, self.score, self.level, self.lines)
+        if seed is not None:
+            self.generator.seed(seed)
+        # Start a new game on an empty board
+        self.board = BOARD_BACKENDS[self.backend]()
+        self.falling_piece = getNewPiece(self.generator)
+        self.next_piece = getNewPiece(self.generator)
+        self.level = 0
+        self.score = 0
+        self.lines = 0
+        self.state = State(self.board, self.falling_piece, self.next_piece, self.score, self.level, self.lines, self.generator, self.beam_width, self.evaluator)
         # Re-initialize the Tetris game model (this resets the game state)
         self.model = TetrisModel(self.state)
 
         # Get the initial observation from the model's state
-        observation = self.state.observation()
+        observation = self.observation()
 
         # Info dictionary (can be expanded for additional metadata)
-        info = {}
+        info = {"key": self.state.key()}
+        if self.action_mode == 'placement':
+            info["action_mask"] = self.action_mask()
 
         return observation, info
 
@@ -97,6 +180,9 @@ class TetrisEnv(gym.Env):
                 - truncated (bool): Always False (used for environments that may truncate episodes based on other criteria).
                 - info (dict): Additional information about the current step.
         """
+        if self.action_mode == 'placement':
+            return self.place(action)
+
         # Get the current state
         state = self.state
 
@@ -107,7 +193,7 @@ class TetrisEnv(gym.Env):
         self.state = state1
 
         # Get the observation (new state of the game)
-        observation = self.state.observation()
+        observation = self.observation()
 
         # Calculate the reward for the action taken
         self.reward = self.model.STEP_COST()
@@ -116,7 +202,7 @@ class TetrisEnv(gym.Env):
         terminated = self.model.GOAL_TEST()
 
         # Additional information (can be expanded as needed)
-        info = {}
+        info = {"key": self.state.key()}
 
         # Render the game if render_mode is "human"
         if self.render_mode == "human":
@@ -125,27 +211,227 @@ class TetrisEnv(gym.Env):
         # Return the updated observation, reward, termination status, truncated flag, and info
         return observation, self.reward, terminated, info
 
-    def render(self, mode='human'):
+    def _profiled_step(self, action):
+        with self.profiler:
+            observation, reward, terminated, info = TetrisEnv.step(self, action)
+        info["profile"] = self.profiler.lastStep()
+        return observation, reward, terminated, info
+
+    def _profiled_calls(self):
+        # the methods a profiled step is timed by, on the objects in use now;
+        # every state's planner searches with self.evaluator, also when it
+        # is built during the step
+        model = self.model
+        calls = [(model, 'RESULT', True), (model, 'advance_game_state', True), (model, 'STEP_COST', True),
+                 (model, 'GOAL_TEST', True), (self, 'render', True),
+                 (self.evaluator, 'returnBestState', True), (self.evaluator, 'returnBestStateLookahead', True)]
+        if self.state.board.__class__ is not list:
+            # gameLogic.isValidPosition hands a BitBoard's calls to the board
+            calls.append((self.state.board, 'isValidPosition', False))
+        return calls
+
+    def _counted_calls(self):
+        # gameLogic.isValidPosition checks list boards itself, and counts
+        # them for the boards in countedBoards
+        if self.state.board.__class__ is list:
+            return [(countedBoards, id(self.state.board), 'isValidPosition')]
+        return []
+
+    def stats(self):
+        """
+        Returns the step timings collected since the env was made with
+        profile=True: calls and seconds of RESULT, advance_game_state,
+        STEP_COST, GOAL_TEST, render and the planner's returnBestState and
+        returnBestStateLookahead, and the number of isValidPosition calls,
+        keyed by call stack such as
+        'step;RESULT;advance_game_state'. Each step's own counters are in its
+        info["profile"]; self.profiler.folded() gives a flame graph input.
+
+        Returns:
+            dict: The totals and per step averages, empty without profiling.
+        """
+        if self.profiler is None:
+            return {}
+        return self.profiler.stats()
+
+    def action_mask(self):
+        """
+        Marks the placements the falling piece can reach. With the 'straight'
+        placement search it is turned to the rotation where it is, then moves
+        one column sideways for every row it falls (see getReachableXRange)
+        and is dropped. With 'bfs' a placement is reachable if any sequence
+        of moves brings the piece to rest in that rotation and column; when
+        it can rest at several heights there, place() takes the lowest.
+
+        Returns:
+            array: NUM_PLACEMENTS int8 values, 1 for a reachable placement,
+            usable as action_space.sample(mask=...).
+        """
+        if self._mask_state is self.state:
+            return self._mask  # every step makes a new state
+        piece = self.state.falling_piece
+        mask = np.zeros(NUM_PLACEMENTS, dtype=np.int8)
+        if self.placement_search == 'bfs':
+            # action -> resting piece, for place()
+            self._placed = {}
+            for placed, path in getReachablePlacements(self.state.board, piece, paths=False):
+                action = placed['rotation'] * BOARDWIDTH + placed['x'] + PIECE_GEOMETRY[piece['shape']][placed['rotation']].minX
+                if action not in self._placed or placed['y'] > self._placed[action]['y']:
+                    self._placed[action] = placed
+            mask[list(self._placed)] = 1
+            self._mask, self._mask_state = mask, self.state
+            return mask
+        probe = piece.copy()
+        for rotation, geometry in enumerate(PIECE_GEOMETRY[piece['shape']]):
+            probe['rotation'] = rotation
+            reachable = getReachableXRange(self.state.board, probe)
+            if reachable:
+                first = rotation * BOARDWIDTH + geometry.minX
+                mask[first + reachable.start:first + reachable.stop] = 1
+        self._mask, self._mask_state = mask, self.state
+        return mask
+
+    def place(self, action):
+        """
+        Applies a placement action: the falling piece moves to the chosen
+        rotation and column, drops and locks, full lines are cleared and the
+        next piece spawns, all in one step.
+
+        Args:
+            action (int): rotation * BOARDWIDTH + leftmost column, it must be
+                marked in action_mask().
+
+        Returns:
+            tuple: Observation, reward, terminated and info, as from step().
+            The reward is -1 for the piece plus 10 per cleared line.
+        """
+        state = self.state
+        piece = state.falling_piece
+        if not 0 <= action < NUM_PLACEMENTS or not self.action_mask()[action]:
+            raise ValueError(f"Placement {action} is not reachable for the falling piece, see action_mask()")
+        if self.placement_search == 'bfs':
+            piece.update(self._placed[action])
+        else:
+            x = PLACEMENT_X[piece['shape']][action]
+            # the piece fell one row for every column it moved
+            piece['y'] += abs(x - piece['x'])
+            piece['rotation'] = action // BOARDWIDTH
+            piece['x'] = x
+            piece['y'] = getLandingRow(state.board, piece)
+
+        # lock the piece and spawn the next one, as gravity would
+        self.model.advance_game_state()
+        self.reward = self.model.STEP_COST()
+        self.state = State(state.board, state.falling_piece, state.next_piece, state.score, state.level, state.lines_cleared, state.generator, self.beam_width, self.evaluator)
+        self.model.state = self.state
+        terminated = self.model.GOAL_TEST()
+
+        observation = self.observation()
+        info = {"key": self.state.key()}
+        info["action_mask"] = np.zeros(NUM_PLACEMENTS, dtype=np.int8) if terminated else self.action_mask()
+        if self.render_mode == "human":
+            self.render()
+        return observation, self.reward, terminated, info
+
+    def observation(self, out=None):
+        """
+        Returns the observation of the current state, laid out as in
+        observation_space.
+
+        The board is a read-only view of the board's own cell buffer (see
+        BitBoard.cells), so it costs no copy and shows the board as it is
+        updated by later steps. Use out to keep a snapshot instead.
+
+        Args:
+            out (dict, optional): Observation to copy into, e.g. an earlier
+                result of observation_space.sample(). Its arrays are reused.
+
+        Returns:
+            dict: The observation, out itself if given.
+        """
+        state = self.state
+        if out is None:
+            board = boardArray(state.board).view()
+            board.flags.writeable = False
+            return {
+                "board": board,
+                "falling_piece": encode_piece(state.falling_piece),
+                "next_piece": encode_piece(state.next_piece),
+                "score": state.score,
+                "level": state.level,
+                "lines": state.lines_cleared,
+            }
+        np.copyto(out["board"], boardArray(state.board))
+        encode_piece(state.falling_piece, out["falling_piece"])
+        encode_piece(state.next_piece, out["next_piece"])
+        out["score"] = state.score
+        out["level"] = state.level
+        out["lines"] = state.lines_cleared
+        return out
+
+    def snapshot(self):
+        """
+        Captures the game in a small bytes blob: board, falling and next
+        piece, score, level, lines and the piece generator's state.
+
+        Returns:
+            bytes: The snapshot, to be passed to restore().
+        """
+        state = self.state
+        falling = state.falling_piece
+        nextPiece = state.next_piece
+        generatorState, bag = self.generator.getstate()
+        return SNAPSHOT_STRUCT.pack(
+            falling['color'], falling['rotation'], falling['x'], falling['y'],
+            nextPiece['color'], nextPiece['rotation'], nextPiece['x'], nextPiece['y'],
+            state.score, state.level, state.lines_cleared, state.fall_freq,
+            generatorState, len(bag), bytes(SHAPE_INDEX[shape] for shape in bag)) + snapshotBoard(state.board)
+
+    def restore(self, snap):
+        """
+        Returns the game to the point where snapshot() was taken. The board is
+        restored in place, so the env can branch from one snapshot any number
+        of times. Snapshots can be restored in any env, whatever its backend.
+
+        Args:
+            snap (bytes): A blob returned by snapshot().
+        """
+        (fallingShape, fallingRotation, fallingX, fallingY, nextShape, nextRotation, nextX, nextY,
+         score, level, lines, fallFreq, generatorState, bagLength, bag) = SNAPSHOT_STRUCT.unpack_from(snap)
+        restoreBoard(self.board, memoryview(snap)[SNAPSHOT_STRUCT.size:])
+        self.generator.setstate((generatorState, [SHAPES[i] for i in bag[:bagLength]]))
+        falling = {'shape': SHAPES[fallingShape], 'rotation': fallingRotation, 'x': fallingX, 'y': fallingY, 'color': fallingShape}
+        nextPiece = {'shape': SHAPES[nextShape], 'rotation': nextRotation, 'x': nextX, 'y': nextY, 'color': nextShape}
+        self.state = State(self.board, falling, nextPiece, score, level, lines, self.generator, self.beam_width, self.evaluator)
+        self.state.fall_freq = fallFreq
+        self.model = TetrisModel(self.state)
+
+    def render(self, mode=None):
         """
-        Renders the environment. Currently, it prints the board state to the console.
-        :param mode: The rendering mode.
+        Renders the environment.
+        :param mode: The rendering mode, defaults to the env's render_mode and
+            then to 'human'. 'rgb_array' returns the board with the falling
+            piece as a (BOARDHEIGHT * BOXSIZE, BOARDWIDTH * BOXSIZE, 3) uint8
+            array, built with NumPy and without pygame.
         """
+        mode = mode or self.render_mode or 'human'
+        if mode == 'rgb_array':
+            return renderBoards(getBoardCells(self.state.board, self.state.falling_piece))
         if mode == 'human':
-            board = self.state.observation()
-            # print("\n".join("".join(str(cell) for cell in row) for row in board.T))
+            ensureDisplay()  # pygame is loaded and the window opened on the first render
             if self.state.falling_piece is None:
                 # No falling piece in play, so start a new piece at the top
                 self.state.falling_piece = self.state.next_piece
-                self.state.next_piece = getNewPiece()
+                self.state.next_piece = getNewPiece(self.generator)
                 while self.state.next_piece == self.state.falling_piece:
-                    self.state.next_piece = getNewPiece()
+                    self.state.next_piece = getNewPiece(self.generator)
                 self.last_fall_time = time.time()  # reset lastFallTime
 
                 if not isValidPosition(self.state.board, self.state.falling_piece):
                     # pygame.quit()
                     #("should be done now lol")
                     return [self.state.score, self.state.lines_cleared]  # can't fit a new piece on the board, so game over
-                self.state.gh.newPiece(self.state.falling_piece, self.state.board)
+                self.state.gh.newPiece(self.state.falling_piece, self.state.board, self.state.next_piece)
 
             checkForQuit()
 
@@ -153,14 +439,9 @@ class TetrisEnv(gym.Env):
             self.state.movingLeft = False
             self.state.movingRight = False
 
-            # drawing everything on the screen
-            fillBG()
-            drawBoard(self.state.board)
-            drawStatus(self.state.score, self.state.lines_cleared, self.state.level, self.state.brain)
-            drawNextPiece(self.state.next_piece)
-            if self.state.falling_piece is not None:
-                drawPiece(self.state.falling_piece)
-            updateDisplay()
+            # drawing what changed on the screen
+            self.renderer.draw(self.state.board, self.state.falling_piece, self.state.next_piece,
+                               self.state.score, self.state.lines_cleared, self.state.level)
         else:
             super().render()  # Raise an exception for unsupported modes
 
@@ -0,0 +1,61 @@
+import numpy as np
+
+from gameLogic import BOARDWIDTH, BOARDHEIGHT, BOXSIZE, BGCOLOR, COLORS, LIGHTCOLORS, PIECE_GEOMETRY
+from bitboard import boardArray
+
+# Offscreen rendering of boards to RGB arrays, without pygame.
+#
+# Cells are encoded as in TetrisVectorEnv: 0 for an empty cell and color + 1
+# for a filled one. BOX_TILES holds one BOXSIZE x BOXSIZE tile per code, drawn
+# the same way as gameLogic.drawBox, so a frame is just the tiles of its cells
+# laid out side by side.
+
+
+def compileBoxTile(color):
+    # pixels of a single box, see drawBox
+    tile = np.empty((BOXSIZE, BOXSIZE, 3), dtype=np.uint8)
+    tile[:] = BGCOLOR
+    tile[1:BOXSIZE, 1:BOXSIZE] = COLORS[color]
+    tile[1:BOXSIZE - 3, 1:BOXSIZE - 3] = LIGHTCOLORS[color]
+    return tile
+
+
+BOX_TILES = np.stack([np.full((BOXSIZE, BOXSIZE, 3), BGCOLOR, dtype=np.uint8)]
+                     + [compileBoxTile(color) for color in range(len(COLORS))])
+
+FRAME_SHAPE = (BOARDHEIGHT * BOXSIZE, BOARDWIDTH * BOXSIZE, 3)
+
+
+def getBoardCells(board, piece=None):
+    # (BOARDHEIGHT, BOARDWIDTH) int8 array of the cell codes of a board of
+    # either backend, with the falling piece drawn in if given
+    cells = boardArray(board).T.copy()
+    if piece is not None:
+        for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].cells:
+            if piece['y'] + y >= 0:
+                cells[piece['y'] + y, piece['x'] + x] = piece['color'] + 1
+    return cells
+
+
+def renderBoards(cells, out=None):
+    """
+    Renders a batch of boards to RGB frames.
+
+    Args:
+        cells (array): (N, BOARDHEIGHT, BOARDWIDTH) cell codes, or a single
+            (BOARDHEIGHT, BOARDWIDTH) board.
+        out (array, optional): uint8 array of the result's shape to render into.
+
+    Returns:
+        array: (N, BOARDHEIGHT * BOXSIZE, BOARDWIDTH * BOXSIZE, 3) uint8 frames,
+        or a single frame for a single board.
+    """
+    cells = np.asarray(cells)
+    # tiles is (N, rows, columns, BOXSIZE, BOXSIZE, 3); bringing the pixel
+    # rows next to the board rows turns it into a stack of images
+    tiles = BOX_TILES[cells.reshape(-1, BOARDHEIGHT, BOARDWIDTH)]
+    shape = cells.shape[:-2] + FRAME_SHAPE
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    out.reshape(-1, BOARDHEIGHT, BOXSIZE, BOARDWIDTH, BOXSIZE, 3)[:] = tiles.transpose(0, 1, 3, 2, 4, 5)
+    return out
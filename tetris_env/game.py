@@ -3,15 +3,16 @@
 # http://inventwithpython.com/pygame
 # Released under a "Simplified BSD" license
 
-import random, time, pygame, sys
-from pygame.locals import *
+import random, time, sys
 from tetrisAI import *
 
 
 class Game():
-    def runGame(self, brain = [1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0 ], delay = 0.02):
+    def runGame(self, brain = [1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0 ], delay = 0.5, render = True, beamWidth = 0):
+        # Play one game with the heuristic bot. delay is the pause between
+        # frames in seconds; render=False plays without a window. With a
+        # beamWidth the bot plans with the next piece too.
         # setup variables for the start of the game
-        delay = 0.5
         self.board = getBlankBoard()
         self.lastMoveDownTime = time.time()
         self.lastMoveSidewaysTime = time.time()
@@ -25,13 +26,17 @@ class Game():
 
         self.fallingPiece = getNewPiece()
         self.nextPiece = getNewPiece()
-        self.gh = gameHandler(self.fallingPiece, self.board, brain)
+        self.gh = gameHandler(self.fallingPiece, self.board, brain, beamWidth)
+        self.renderer = BoardRenderer()
+        if render:
+            ensureDisplay()
 
 
 
         while True: # game loop
 
-            time.sleep(delay)
+            if delay:
+                time.sleep(delay)
             if self.fallingPiece == None:
                 # No falling piece in play, so start a new piece at the top
                 self.fallingPiece = self.nextPiece
@@ -44,11 +49,12 @@ class Game():
                 if not isValidPosition(self.board, self.fallingPiece):
                     #pygame.quit()
                     return [self.score, self.lines] # can't fit a new piece on the board, so game over
-                self.gh.newPiece(self.fallingPiece, self.board)
+                self.gh.newPiece(self.fallingPiece, self.board, self.nextPiece)
 
-            checkForQuit()
+            if render:
+                checkForQuit()
             if self.gh.rotatePiece(self.fallingPiece['rotation'], self.fallingPiece) != 0:
-                self.fallingPiece['rotation'] += self.gh.rotatePiece(self.fallingPiece['rotation'], self.fallingPiece)
+                self.fallingPiece['rotation'] = (self.fallingPiece['rotation'] + self.gh.rotatePiece(self.fallingPiece['rotation'], self.fallingPiece)) % len(PIECES[self.fallingPiece['shape']])
                 if not isValidPosition(self.board, self.fallingPiece): # kui jupp pöörab end mängulaualt välja
                     if self.fallingPiece['x'] < BOARDWIDTH/2: # kui on vasakul pool mängulauda
                         while not isValidPosition(self.board, self.fallingPiece):
@@ -111,13 +117,8 @@ class Game():
             self.movingRight = False
 
             # drawing everything on the screen
-            fillBG()
-            drawBoard(self.board)
-            drawStatus(self.score, self.lines, self.level, brain)
-            drawNextPiece(self.nextPiece)
-            if self.fallingPiece != None:
-                drawPiece(self.fallingPiece)
-            updateDisplay()
+            if render:
+                self.renderer.draw(self.board, self.fallingPiece, self.nextPiece, self.score, self.lines, self.level)
 
 
 def main():
@@ -1,6 +1,10 @@
-import random, pygame, sys
-from pygame.locals import *
-from game import *
+import random, sys
+from collections import namedtuple
+
+# pygame is only imported once something is drawn (see loadPygame), so the
+# game rules and the env run on machines without a display.
+pygame = None
+DISPLAYSURF = None
 
 
 FPS = 0
@@ -158,12 +162,102 @@ PIECES = {'S': S_SHAPE_TEMPLATE,
           'O': O_SHAPE_TEMPLATE,
           'T': T_SHAPE_TEMPLATE}
 
-piece_bag = list(PIECES)
-random.shuffle(piece_bag)
+# Piece geometry compiled once from the templates above. For every shape and
+# rotation PIECE_GEOMETRY holds:
+#   cells      - (x, y) template offsets of the filled cells
+#   minX..maxY - bounding box of the filled cells inside the 5x5 template
+#   bottom     - (x, y) of the lowest filled cell of every filled template column
+#   spawnRange - piece['x'] values that keep the piece inside the board's columns
+PieceGeometry = namedtuple('PieceGeometry', ['cells', 'minX', 'minY', 'maxX', 'maxY', 'bottom', 'spawnRange'])
+
+
+def compilePieceGeometry(template):
+    cells = tuple((x, y) for y in range(TEMPLATEHEIGHT) for x in range(TEMPLATEWIDTH) if template[y][x] != BLANK)
+    xs = [x for x, y in cells]
+    ys = [y for x, y in cells]
+    bottom = tuple((x, max(cy for cx, cy in cells if cx == x)) for x in sorted(set(xs)))
+    return PieceGeometry(cells, min(xs), min(ys), max(xs), max(ys), bottom,
+                         range(-min(xs), BOARDWIDTH - max(xs)))
+
+
+PIECE_GEOMETRY = {shape: tuple(compilePieceGeometry(template) for template in PIECES[shape]) for shape in PIECES}
+SHAPE_INDEX = {shape: i for i, shape in enumerate(PIECES)}
+
+MASK64 = (1 << 64) - 1
+
+
+class PieceGenerator:
+    """
+    Deals pieces from its own shuffled bag of all seven shapes, using its own
+    random number generator (splitmix64), so every env can have a private,
+    reproducible piece sequence. The whole state is one integer and the bag.
+    """
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        # Restart the sequence. Without a seed one is taken from the global random module.
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.state = seed & MASK64
+        self.bag = []
+
+    def randbelow(self, n):
+        # splitmix64 step, reduced to 0 <= value < n
+        self.state = (self.state + 0x9E3779B97F4A7C15) & MASK64
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return (z ^ (z >> 31)) % n
+
+    def nextShape(self):
+        # Return the (shape, rotation) of the next piece
+        if not self.bag:
+            bag = list(PIECES)
+            for i in range(len(bag) - 1, 0, -1):  # Fisher-Yates shuffle
+                j = self.randbelow(i + 1)
+                bag[i], bag[j] = bag[j], bag[i]
+            self.bag = bag
+        shape = self.bag.pop(0)
+        return shape, self.randbelow(len(PIECES[shape]))
+
+    def generate(self, count):
+        # Pre-generate the next count (shape, rotation) pairs in one go
+        return [self.nextShape() for _ in range(count)]
+
+    def getNewPiece(self):
+        shape, rotation = self.nextShape()
+        return {'shape': shape,
+                'rotation': rotation,
+                'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
+                'y': -2, # start it above the board (i.e. less than 0)
+                'color' : SHAPE_INDEX[shape]}
+
+    def getstate(self):
+        return self.state, tuple(self.bag)
+
+    def setstate(self, state):
+        self.state, bag = state
+        self.bag = list(bag)
+
+
+# Used by getNewPiece when no generator is given
+defaultGenerator = PieceGenerator()
+
+def loadPygame():
+    # import pygame on first use
+    global pygame
+    if pygame is None:
+        import pygame as pygameModule
+        pygame = pygameModule
+    return pygame
+
 
 def initPygame():
     global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT, SMALLFONT
 
+    loadPygame()
     pygame.init()
     FPSCLOCK = pygame.time.Clock()
     DISPLAYSURF = pygame.display.set_mode((WINDOWWIDTH, WINDOWHEIGHT))
@@ -172,6 +266,11 @@ def initPygame():
     BIGFONT = pygame.font.Font('freesansbold.ttf', 100)
     pygame.display.set_caption('Tetromino')
 
+def ensureDisplay():
+    # open the window the first time something needs to be drawn
+    if DISPLAYSURF is None:
+        initPygame()
+
 def fillBG():
     DISPLAYSURF.fill(BGCOLOR)
 
@@ -194,8 +293,8 @@ def checkForKeyPress():
     # Grab KEYDOWN events to remove them from the event queue.
     checkForQuit()
 
-    for event in pygame.event.get([KEYDOWN, KEYUP]):
-        if event.type == KEYDOWN:
+    for event in pygame.event.get([pygame.KEYDOWN, pygame.KEYUP]):
+        if event.type == pygame.KEYDOWN:
             continue
         return event.key
     return None
@@ -225,10 +324,10 @@ def showTextScreen(text):
 
 
 def checkForQuit():
-    for event in pygame.event.get(QUIT): # get all the QUIT events
+    for event in pygame.event.get(pygame.QUIT): # get all the QUIT events
         terminate() # terminate if any QUIT events are present
-    for event in pygame.event.get(KEYUP): # get all the KEYUP events
-        if event.key == K_ESCAPE:
+    for event in pygame.event.get(pygame.KEYUP): # get all the KEYUP events
+        if event.key == pygame.K_ESCAPE:
             terminate() # terminate if the KEYUP event was for the Esc key
         pygame.event.post(event) # put the other KEYUP event objects back
 
@@ -247,29 +346,63 @@ def updateScore(board, level):
         return (0,0)
     return 10, lines
 
-def getNewPiece():
-    # return a new piece from the piece bag
-    global piece_bag
-    if piece_bag == []:
-        piece_bag = list(PIECES)
-        random.shuffle(piece_bag)
-
-    shape = piece_bag.pop(0)
-
-    newPiece = {'shape': shape,
-                'rotation': random.randint(0, len(PIECES[shape]) - 1),
-                'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
-                'y': -2, # start it above the board (i.e. less than 0)
-                'color' : list(PIECES.keys()).index(shape)}
-    return newPiece
+def getNewPiece(generator=None):
+    # return a new piece from the piece bag of the generator
+    if generator is None:
+        generator = defaultGenerator
+    return generator.getNewPiece()
 
 
 def addToBoard(board, piece):
     # fill in the board based on piece's location, shape, and rotation
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            if PIECES[piece['shape']][piece['rotation']][y][x] != BLANK:
-                board[x + piece['x']][y + piece['y']] = piece['color']
+    if board.__class__ is not list:
+        return board.addToBoard(piece)
+    for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].cells:
+        board[x + piece['x']][y + piece['y']] = piece['color']
+
+
+def removeFromBoard(board, piece):
+    # undo addToBoard: blank the cells covered by the piece
+    if board.__class__ is not list:
+        return board.removeFromBoard(piece)
+    for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].cells:
+        board[x + piece['x']][y + piece['y']] = BLANK
+
+
+def getLandingRow(board, piece):
+    # Return the y the piece comes to rest at when it drops straight down from
+    # its current position. Every column of a piece is a solid run of cells,
+    # so the piece stops right above the first filled cell below the lowest
+    # cell of one of its columns.
+    pieceX = piece['x']
+    pieceY = piece['y']
+    drop = BOARDHEIGHT
+    for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].bottom:
+        column = board[pieceX + x]
+        y += pieceY
+        floor = BOARDHEIGHT
+        for below in range(max(y + 1, 0), BOARDHEIGHT):
+            if column[below] != BLANK:
+                floor = below
+                break
+        if floor - y - 1 < drop:
+            drop = floor - y - 1
+    return pieceY + drop
+
+
+def getReachableXRange(board, piece):
+    # Return the range of x the piece can be steered to from where it is,
+    # keeping its rotation, when it moves one column sideways for every row
+    # it falls. The range is empty if the piece does not fit where it is.
+    if not isValidPosition(board, piece):
+        return range(0)
+    left = 0
+    while isValidPosition(board, piece, adjX=-(left + 1), adjY=left + 1):
+        left += 1
+    right = 0
+    while isValidPosition(board, piece, adjX=right + 1, adjY=right + 1):
+        right += 1
+    return range(piece['x'] - left, piece['x'] + right + 1)
 
 
 def getBlankBoard():
@@ -284,24 +417,41 @@ def isOnBoard(x, y):
     return x >= 0 and x < BOARDWIDTH and y < BOARDHEIGHT
 
 
+# Collision checks of list boards counted by a profiler, see
+# TetrisEnv(profile=True): id(board) -> function called on every check of
+# that board. Entries only exist while a profiled step runs.
+countedBoards = {}
+
+
 def isValidPosition(board, piece, adjX=0, adjY=0):
     if piece is None:
         return False
+    if board.__class__ is not list:
+        # other board backends (see bitboard.py) bring their own collision test
+        return board.isValidPosition(piece, adjX, adjY)
+    if countedBoards:
+        counter = countedBoards.get(id(board))
+        if counter is not None:
+            counter()
     # Return True if the piece is within the board and not colliding
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            isAboveBoard = y + piece['y'] + adjY < 0
-            if isAboveBoard or PIECES[piece['shape']][piece['rotation']][y][x] == BLANK:
-                continue
-            if not isOnBoard(x + piece['x'] + adjX, y + piece['y'] + adjY):
-                return False
-            if board[x + piece['x'] + adjX][y + piece['y'] + adjY] != BLANK:
-                return False
+    pieceX = piece['x'] + adjX
+    pieceY = piece['y'] + adjY
+    for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].cells:
+        y += pieceY
+        if y < 0:
+            continue  # cells above the board never collide
+        x += pieceX
+        if x < 0 or x >= BOARDWIDTH or y >= BOARDHEIGHT:
+            return False
+        if board[x][y] != BLANK:
+            return False
     # print("validation done")
     return True
 
 def isCompleteLine(board, y):
     # Return True if the line filled with boxes with no gaps.
+    if board.__class__ is not list:
+        return board.isCompleteLine(y)
     for x in range(BOARDWIDTH):
         if board[x][y] == BLANK:
             return False
@@ -310,6 +460,8 @@ def isCompleteLine(board, y):
 
 def removeCompleteLines(board):
     # Remove any completed lines on the board, move everything above them down, and return the number of complete lines.
+    if board.__class__ is not list:
+        return board.removeCompleteLines()
     numLinesRemoved = 0
     y = BOARDHEIGHT - 1 # start y at the bottom of the board
     while y >= 0:
@@ -330,6 +482,26 @@ def removeCompleteLines(board):
     return numLinesRemoved
 
 
+def getCompleteLines(board):
+    # Return (y, cells) for every complete line, cells holding the line's colors.
+    # Pass the result to restoreCompleteLines to undo removeCompleteLines.
+    if board.__class__ is not list:
+        return board.getCompleteLines()
+    return [(y, [board[x][y] for x in range(BOARDWIDTH)]) for y in range(BOARDHEIGHT) if isCompleteLine(board, y)]
+
+
+def restoreCompleteLines(board, lines):
+    # Put back the lines returned by getCompleteLines after removeCompleteLines
+    # took them out. lines must be in the top to bottom order it was returned in.
+    if board.__class__ is not list:
+        return board.restoreCompleteLines(lines)
+    for x in range(BOARDWIDTH):
+        column = board[x]
+        del column[:len(lines)]
+        for y, cells in lines:
+            column.insert(y, cells[x])
+
+
 def convertToPixelCoords(boxx, boxy):
     # Convert the given xy coordinates of the board to xy
     # coordinates of the location on the screen.
@@ -393,16 +565,13 @@ def drawStatus(score, lines, level, brain):
 
 
 def drawPiece(piece, pixelx=None, pixely=None):
-    shapeToDraw = PIECES[piece['shape']][piece['rotation']]
     if pixelx == None and pixely == None:
         # if pixelx & pixely hasn't been specified, use the location stored in the piece data structure
         pixelx, pixely = convertToPixelCoords(piece['x'], piece['y'])
 
     # draw each of the boxes that make up the piece
-    for x in range(TEMPLATEWIDTH):
-        for y in range(TEMPLATEHEIGHT):
-            if shapeToDraw[y][x] != BLANK:
-                drawBox(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
+    for x, y in PIECE_GEOMETRY[piece['shape']][piece['rotation']].cells:
+        drawBox(None, None, piece['color'], pixelx + (x * BOXSIZE), pixely + (y * BOXSIZE))
 
 
 def drawNextPiece(piece):
@@ -412,4 +581,118 @@ def drawNextPiece(piece):
     nextRect.topleft = (WINDOWWIDTH - 120, 110)
     DISPLAYSURF.blit(nextSurf, nextRect)
     # draw the "next" piece
-    drawPiece(piece, pixelx=WINDOWWIDTH-120, pixely=130)
\ No newline at end of file
+    drawPiece(piece, pixelx=WINDOWWIDTH-120, pixely=130)
+
+class BoardRenderer:
+    """
+    Retained-mode version of the fillBG / drawBoard / drawStatus /
+    drawNextPiece / drawPiece / updateDisplay sequence.
+
+    The renderer remembers what it drew last. Each call to draw() repaints
+    only the board cells, status texts and next piece that changed since then.
+    It hands just those rectangles to pygame.display.update. A status text
+    is only rendered again when its value changed since the last frame. The
+    first frame, and every frame
+    after invalidate() or a new display surface, is drawn in full.
+    """
+    HIDDENROWS = 2  # rows above the board that a new piece spawns in
+
+    def __init__(self):
+        self.surface = None
+        self.hiddenRect = None
+        self.hiddenBackground = None
+        self.cells = None
+        self.nextPiece = None
+        self.texts = {}
+
+    def invalidate(self):
+        # draw everything again on the next frame, e.g. after something else
+        # was drawn on the window
+        self.surface = None
+
+    def drawText(self, name, text, topleft, dirty):
+        # blit text unless the same text is already shown at that place
+        old = self.texts.get(name)
+        if old is not None and old[0] == text:
+            return
+        surf, rect = makeTextObjs(text, BASICFONT, TEXTCOLOR)
+        rect.topleft = topleft
+        if old is not None:
+            DISPLAYSURF.fill(BGCOLOR, old[1])
+            dirty.append(old[1])
+        DISPLAYSURF.blit(surf, rect)
+        dirty.append(rect)
+        self.texts[name] = (text, rect)
+
+    def draw(self, board, fallingPiece, nextPiece, score, lines, level):
+        ensureDisplay()
+        dirty = []
+        if self.surface is not DISPLAYSURF:
+            # full redraw: background, border and the fixed labels
+            self.surface = DISPLAYSURF
+            self.cells = None
+            self.nextPiece = None
+            self.texts = {}
+            fillBG()
+            pygame.draw.rect(DISPLAYSURF, BORDERCOLOR, (XMARGIN - 3, TOPMARGIN - 7, (BOARDWIDTH * BOXSIZE) + 8, (BOARDHEIGHT * BOXSIZE) + 8), 5)
+            self.drawText('title', 'Youssef Elkhayat, CS4300 Final Project:', (15, 15), dirty)
+            self.drawText('next', 'Next:', (WINDOWWIDTH - 120, 110), dirty)
+            dirty = [DISPLAYSURF.get_rect()]
+            # The rows above the board overlap the top of the border, so keep
+            # what lies under them to paint over a piece that moved away.
+            self.hiddenRect = pygame.Rect(XMARGIN - 3, TOPMARGIN - self.HIDDENROWS * BOXSIZE, (BOARDWIDTH * BOXSIZE) + 8, self.HIDDENROWS * BOXSIZE)
+            self.hiddenBackground = DISPLAYSURF.subsurface(self.hiddenRect).copy()
+
+        # The board with the falling piece in it, as a flat list of cells.
+        # Every column starts with the rows above the board a new piece
+        # spawns in, as drawPiece draws those too.
+        hidden = [BLANK] * self.HIDDENROWS
+        rows = BOARDHEIGHT + self.HIDDENROWS
+        cells = []
+        for column in board:
+            cells += hidden
+            cells += column
+        if fallingPiece is not None:
+            for x, y in PIECE_GEOMETRY[fallingPiece['shape']][fallingPiece['rotation']].cells:
+                x += fallingPiece['x']
+                y += fallingPiece['y'] + self.HIDDENROWS
+                if 0 <= x < BOARDWIDTH and 0 <= y < rows:
+                    cells[x * rows + y] = fallingPiece['color']
+        last = self.cells
+        hiddenChanged = False
+        for i, cell in enumerate(cells):
+            if last is None or last[i] != cell:
+                x, y = divmod(i, rows)
+                y -= self.HIDDENROWS
+                if y < 0:
+                    hiddenChanged = True
+                    continue
+                pixelx, pixely = convertToPixelCoords(x, y)
+                rect = pygame.Rect(pixelx, pixely, BOXSIZE, BOXSIZE)
+                DISPLAYSURF.fill(BGCOLOR, rect)
+                drawBox(x, y, cell)
+                dirty.append(rect)
+        self.cells = cells
+        if hiddenChanged:
+            # redraw the strip above the board as a whole, pieces on top
+            DISPLAYSURF.blit(self.hiddenBackground, self.hiddenRect)
+            for x in range(BOARDWIDTH):
+                for y in range(-self.HIDDENROWS, 0):
+                    drawBox(x, y, cells[x * rows + y + self.HIDDENROWS])
+            dirty.append(self.hiddenRect)
+
+        self.drawText('score', 'Score: %s' % score, (WINDOWWIDTH - 150, 20), dirty)
+        self.drawText('lines', 'Lines: %s' % lines, (WINDOWWIDTH - 150, 50), dirty)
+        self.drawText('level', 'Level: %s' % level, (WINDOWWIDTH - 150, 80), dirty)
+
+        nextKey = (nextPiece['shape'], nextPiece['rotation'], nextPiece['color']) if nextPiece is not None else None
+        if nextKey != self.nextPiece:
+            rect = pygame.Rect(WINDOWWIDTH - 120, 130, TEMPLATEWIDTH * BOXSIZE, TEMPLATEHEIGHT * BOXSIZE)
+            DISPLAYSURF.fill(BGCOLOR, rect)
+            if nextPiece is not None:
+                drawPiece(nextPiece, pixelx=WINDOWWIDTH - 120, pixely=130)
+            dirty.append(rect)
+            self.nextPiece = nextKey
+
+        pygame.display.update(dirty)
+        FPSCLOCK.tick(FPS)
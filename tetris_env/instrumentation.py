@@ -0,0 +1,166 @@
+from time import perf_counter
+
+# Optional timing of the engine's hot paths, see TetrisEnv(profile=True).
+#
+# Nothing here is wired into the engine. While a StepProfiler is entered it
+# shadows the profiled methods of the objects a step goes through with timing
+# wrappers, as attributes of those instances, and removes them on exit. The
+# classes and modules are never changed, so other envs and other threads run
+# exactly as before. Calls that have no object to hook, like the collision
+# checks of list boards, are counted through registries keyed by the object
+# they are made for (see gameLogic.countedBoards).
+#
+# Calls are aggregated by their stack of profiled names, e.g.
+# ('step', 'RESULT', 'advance_game_state', 'isValidPosition'), which is the
+# shape flame graph tools take, see StepProfiler.folded().
+
+
+class StepProfiler:
+    """
+    Call counts and times of the profiled methods, per step and in total.
+
+    Use as a context manager around the code to profile; every entered block
+    is one step. Counters are dicts from a stack of names (a tuple) to
+    [calls, seconds], seconds including the time spent in nested calls.
+    """
+
+    def __init__(self, hooks, counters=None):
+        """
+        Args:
+            hooks: Called whenever the profiler is entered, returns the
+                (object, attribute, timed) methods to wrap for that step.
+                Methods not timed are called too often and too briefly to
+                time, so only their calls are counted.
+            counters (optional): Called whenever the profiler is entered,
+                returns (registry, key, name) entries: for that step
+                registry[key] is a function counting a call of name.
+        """
+        self.hooks = hooks
+        self.counters = counters
+        self.stack = ['step']
+        self.steps = 0
+        self.totals = {}
+        self.current = {}
+        self.installed = []
+
+    def count(self, name):
+        # a function counting a call of name at the current stack
+        stack = self.stack
+
+        def countCall():
+            stack.append(name)
+            key = tuple(stack)
+            stack.pop()
+            counter = self.current.get(key)
+            if counter is None:
+                counter = self.current[key] = [0, 0.0]
+            counter[0] += 1
+        return countCall
+
+    def wrap(self, name, func, timed):
+        stack = self.stack
+
+        if not timed:
+            count = self.count(name)
+
+            def countedCall(*args, **kwargs):
+                count()
+                return func(*args, **kwargs)
+            return countedCall
+
+        def timedCall(*args, **kwargs):
+            stack.append(name)
+            key = tuple(stack)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                counter = self.current.get(key)
+                if counter is None:
+                    counter = self.current[key] = [0, 0.0]
+                counter[0] += 1
+                counter[1] += elapsed
+        return timedCall
+
+    def __enter__(self):
+        installed = []
+        for owner, attribute, timed in self.hooks():
+            if attribute in vars(owner):
+                continue  # already wrapped, by a profiler further up
+            setattr(owner, attribute, self.wrap(attribute, getattr(owner, attribute), timed))
+            installed.append((owner, attribute))
+        registered = []
+        if self.counters is not None:
+            for registry, key, name in self.counters():
+                if key in registry:
+                    continue  # already counted, by a profiler further up
+                registry[key] = self.count(name)
+                registered.append((registry, key))
+        self.installed.append((installed, registered))
+        self.current = {}
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        installed, registered = self.installed.pop()
+        for owner, attribute in installed:
+            delattr(owner, attribute)
+        for registry, key in registered:
+            del registry[key]
+        self.current[('step',)] = [1, elapsed]
+        for key, (calls, seconds) in self.current.items():
+            counter = self.totals.get(key)
+            if counter is None:
+                self.totals[key] = [calls, seconds]
+            else:
+                counter[0] += calls
+                counter[1] += seconds
+        self.steps += 1
+        return False
+
+    def lastStep(self):
+        # counters of the last step, keyed by ';'-joined stacks
+        return {';'.join(key): {'calls': calls, 'seconds': seconds} for key, (calls, seconds) in self.current.items()}
+
+    def stats(self):
+        """
+        Returns:
+            dict: For every stack of profiled names, joined with ';', its calls,
+            total seconds, and calls and seconds per step.
+        """
+        steps = max(self.steps, 1)
+        return {';'.join(key): {'calls': calls, 'seconds': seconds,
+                                'calls_per_step': calls / steps, 'seconds_per_step': seconds / steps}
+                for key, (calls, seconds) in sorted(self.totals.items())}
+
+    def folded(self, metric='seconds'):
+        """
+        Summarizes the totals in the folded stack format of flamegraph.pl and
+        speedscope: one 'step;RESULT;advance_game_state 1234' line per stack.
+
+        Args:
+            metric (str): 'seconds' for the self time of every stack in
+                microseconds, i.e. without its profiled children, or 'calls'.
+
+        Returns:
+            str: The summary, one line per stack.
+        """
+        if metric == 'calls':
+            values = {key: calls for key, (calls, seconds) in self.totals.items()}
+        elif metric == 'seconds':
+            values = {key: seconds for key, (calls, seconds) in self.totals.items()}
+            for key, (calls, seconds) in self.totals.items():
+                if len(key) > 1 and key[:-1] in values:
+                    values[key[:-1]] -= seconds
+            values = {key: round(seconds * 1e6) for key, seconds in values.items()}
+        else:
+            raise ValueError(f"Unknown metric '{metric}', expected 'seconds' or 'calls'")
+        return '\n'.join('%s %d' % (';'.join(key), value) for key, value in sorted(values.items()) if value > 0)
+
+    def reset(self):
+        self.steps = 0
+        self.totals = {}
+        self.current = {}
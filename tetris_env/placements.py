@@ -0,0 +1,193 @@
+from bisect import bisect_right
+
+from gameLogic import BOARDHEIGHT, BOARDWIDTH, TEMPLATEHEIGHT
+from bitboard import boardRows, PIECE_ROW_MASKS, EMPTY_ROW, ROW_BITS, WALL
+
+# Search for every place a piece can come to rest, including the ones only
+# reachable by sliding along the stack or tucking under an overhang.
+#
+# Positions are kept as bitsets of x: for one rotation and row, bit WALL + x
+# is set when the piece fits (or was reached) with its template at x. A
+# piece moves left, right, turns or moves down one row at a time, without
+# gravity in between, and rests once it can not move down.
+
+# Moves of a path, numbered like the actions of TetrisModel.RESULT. 5 (do
+# nothing) stands for the piece falling one row.
+MOVE_LEFT = 0
+MOVE_RIGHT = 1
+MOVE_CW = 2
+MOVE_CCW = 3
+MOVE_DOWN = 5
+
+# every x the bitsets cover, from -WALL up to the last column
+X_MASK = (1 << (WALL + BOARDWIDTH)) - 1
+
+
+def compileBlockedTable(mask):
+    # For a template row with the cells in mask, the bitset of x it
+    # collides at in a board row, for every value of the row's columns
+    # (the row without its walls, see bitboard.py).
+    bits = [b for b in range(mask.bit_length()) if mask >> b & 1]
+    table = []
+    for columns in range(ROW_BITS + 1):
+        row = EMPTY_ROW | columns << WALL
+        blocked = 0
+        for b in bits:
+            blocked |= row >> b
+        table.append(blocked)
+    return table
+
+
+# one table per distinct template row, shared by the pieces that have it
+BLOCKED_TABLES = {mask: compileBlockedTable(mask)
+                  for rowMasks in PIECE_ROW_MASKS.values() for rotation in rowMasks for ty, mask in rotation}
+
+# For every template row of a piece, its offset and the table of x it
+# collides at, see compileBlockedTable
+PIECE_ROW_TABLES = {shape: [tuple((ty, BLOCKED_TABLES[mask]) for ty, mask in rowMasks)
+                            for rowMasks in PIECE_ROW_MASKS[shape]]
+                    for shape in PIECE_ROW_MASKS}
+
+
+def getValidX(rows, rowTables, y):
+    # Bitset of the x the piece fits at with its template's top row at y.
+    # Rows above the board are empty apart from the walls.
+    blocked = 0
+    for ty, table in rowTables:
+        if y + ty >= BOARDHEIGHT:
+            return 0
+        blocked |= table[rows[y + ty] >> WALL & ROW_BITS if y + ty >= 0 else 0]
+    return ~blocked & X_MASK
+
+
+# x a piece fits at when none of its rows reach a filled cell
+OPEN_VALID_X = {shape: [getValidX([EMPTY_ROW] * BOARDHEIGHT, rowTables, 0) for rowTables in PIECE_ROW_TABLES[shape]]
+                for shape in PIECE_ROW_TABLES}
+
+
+def getReachablePlacements(board, piece, paths=True):
+    """
+    Finds every resting place the piece can be moved to from where it is.
+
+    One pass goes down the board row by row. In every row the positions
+    reached from the row above are spread sideways and through rotations
+    with bitset operations, so each position is visited once.
+
+    Args:
+        board: The board, a BitBoard or a list of columns.
+        piece (dict): The falling piece, left unchanged.
+        paths (bool): Also find the moves to every resting place. Without
+            them the search only spreads bitsets, and runs about twice as
+            fast.
+
+    Returns:
+        list: (placed, path) for every distinct resting position, in the
+              order they were found. placed is a copy of the piece at rest
+              and path the list of MOVE_* that takes the piece there, or
+              None without paths.
+    """
+    rows = boardRows(board)
+    shape = piece['shape']
+    rowTables = PIECE_ROW_TABLES[shape]
+    openValid = OPEN_VALID_X[shape]
+    numRotations = len(rowTables)
+    startY = y = piece['y']
+    start = 1 << (piece['x'] + WALL)
+    # Down to openY, every row the piece covers is still empty
+    top = 0
+    while top < BOARDHEIGHT and rows[top] == EMPTY_ROW:
+        top += 1
+    openY = top - TEMPLATEHEIGHT
+
+    # valid[r] is the bitset of row y, nextValid[r] that of the row below
+    valid = [getValidX(rows, rowTables[r], y) for r in range(numRotations)]
+    if not valid[piece['rotation']] & start:
+        return []
+    reach = [0] * numRotations
+    reach[piece['rotation']] = start
+    # (rotation, x, y) -> (the position it was reached from, move), for the
+    # positions not reached by moving down. entered[(rotation, x)] lists the
+    # rows of those positions, top to bottom, see getPath.
+    parents = {}
+    entered = {(piece['rotation'], piece['x']): [startY]}
+    placements = []
+
+    while True:
+        # spread through the row until nothing new is reached
+        changed = reach != valid
+        while changed:
+            changed = False
+            for r in range(numRotations):
+                fill = reach[r]
+                while True:
+                    grow = ((fill << 1) | (fill >> 1)) & valid[r] & ~fill
+                    if not grow:
+                        break
+                    if not paths:
+                        fill |= grow
+                        continue
+                    while grow:
+                        bit = grow & -grow
+                        grow ^= bit
+                        x = bit.bit_length() - 1 - WALL
+                        if fill & (bit >> 1):
+                            parents[(r, x, y)] = ((r, x - 1, y), MOVE_RIGHT)
+                        else:
+                            parents[(r, x, y)] = ((r, x + 1, y), MOVE_LEFT)
+                        entered.setdefault((r, x), []).append(y)
+                        fill |= bit
+                reach[r] = fill
+                for turned, move in (((r + 1) % numRotations, MOVE_CW), ((r - 1) % numRotations, MOVE_CCW)):
+                    new = fill & valid[turned] & ~reach[turned]
+                    if new:
+                        changed = True
+                        reach[turned] |= new
+                        while paths and new:
+                            bit = new & -new
+                            new ^= bit
+                            x = bit.bit_length() - 1 - WALL
+                            parents[(turned, x, y)] = ((r, x, y), move)
+                            entered.setdefault((turned, x), []).append(y)
+
+        # positions that can not move down are resting places
+        if y + 1 < openY:
+            nextValid = openValid
+        else:
+            nextValid = [getValidX(rows, rowTables[r], y + 1) for r in range(numRotations)]
+            for r in range(numRotations):
+                resting = reach[r] & ~nextValid[r]
+                while resting:
+                    bit = resting & -resting
+                    resting ^= bit
+                    x = bit.bit_length() - 1 - WALL
+                    placed = piece.copy()
+                    placed['rotation'] = r
+                    placed['x'] = x
+                    placed['y'] = y
+                    placements.append((placed, getPath(parents, entered, (r, x, y)) if paths else None))
+
+        reach = [reach[r] & nextValid[r] for r in range(numRotations)]
+        if not any(reach):
+            return placements
+        y += 1
+        valid = nextValid
+
+
+def getPath(parents, entered, position):
+    # Follow the parents back to the start position. A position without a
+    # parent was reached by moving down from the last row its column was
+    # entered in.
+    path = []
+    while True:
+        r, x, y = position
+        if position not in parents:
+            rows = entered[(r, x)]
+            enteredY = rows[bisect_right(rows, y) - 1]
+            path += [MOVE_DOWN] * (y - enteredY)
+            position = (r, x, enteredY)
+            if position not in parents:
+                break  # the start position
+        position, move = parents[position]
+        path.append(move)
+    path.reverse()
+    return path
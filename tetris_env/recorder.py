@@ -0,0 +1,197 @@
+import json
+import os
+
+import gym
+import numpy as np
+
+from gameLogic import BOARDWIDTH, BOARDHEIGHT
+
+# Offline datasets of TetrisEnv steps.
+#
+# TrajectoryRecorder wraps an env and streams one fixed-width record per step
+# into memory-mapped shard files; TrajectoryDataset maps them back for random
+# access. A dataset is a directory of raw shard files and an index.json that
+# lists them with their record counts.
+#
+# A record holds the observation the action was taken in, the action and
+# what came of it. The board is stored as occupancy bits, one per cell in
+# the [x, y] order of the observation, packed into bytes. The next
+# observation of a step is the record after it, unless the step terminated.
+
+BOARD_BYTES = (BOARDWIDTH * BOARDHEIGHT + 7) // 8
+RECORD_DTYPE = np.dtype([
+    ('board', np.uint8, (BOARD_BYTES,)),
+    ('falling_piece', np.int8, (4,)),  # see tetris_model.encode_piece
+    ('next_piece', np.int8, (4,)),
+    ('action', np.int16),
+    ('reward', np.float32),
+    ('terminated', np.bool_),
+    ('episode', np.uint32),
+])
+INDEX_FILE = 'index.json'
+
+
+def packBoard(board):
+    # occupancy bits of an observation's board, see RECORD_DTYPE
+    return np.packbits(np.asarray(board).ravel() != 0)
+
+
+def unpackBoards(packed):
+    # (..., BOARD_BYTES) packed boards to (..., BOARDWIDTH, BOARDHEIGHT) 0/1 cells
+    bits = np.unpackbits(packed, axis=-1, count=BOARDWIDTH * BOARDHEIGHT)
+    return bits.reshape(packed.shape[:-1] + (BOARDWIDTH, BOARDHEIGHT))
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    """
+    Records every step of the wrapped TetrisEnv into a dataset directory.
+
+    Records go straight into a memory-mapped shard of shard_bytes; when it is
+    full the next shard is started. index.json is rewritten at every new
+    shard and on close(), so a dataset is readable up to its last finished
+    shard even if recording stops early. Call close() (or use the recorder
+    as a context manager) to write the records of the last shard.
+    """
+
+    def __init__(self, env, path, shard_bytes=64 << 20):
+        """
+        Args:
+            env: The environment to record, with TetrisEnv's observations.
+            path (str): Directory of the dataset, created if missing. An
+                existing dataset there is overwritten.
+            shard_bytes (int): Size of a full shard file.
+        """
+        super(TrajectoryRecorder, self).__init__(env)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = max(1, shard_bytes // RECORD_DTYPE.itemsize)
+        self.shards = []  # [file name, record count] of every shard
+        self.records = None  # the memmap of the shard being written
+        self.count = 0
+        self.episode = -1
+        self.last_observation = None
+
+    def reset(self, **kwargs):
+        observation, info = self.env.reset(**kwargs)
+        self.last_observation = observation
+        self.episode += 1
+        return observation, info
+
+    def step(self, action):
+        last = self.last_observation
+        if last is None:
+            raise RuntimeError("Call reset() before step()")
+        if self.records is None or self.count == self.capacity:
+            self._next_shard()
+        # The board of an observation is a view of the live board, so it is
+        # packed before the step changes it
+        board = packBoard(last['board'])
+        observation, reward, terminated, info = self.env.step(action)
+        # one assignment of the whole record is cheaper than one per field
+        self.records[self.count] = (board, last['falling_piece'], last['next_piece'],
+                                    action, reward, terminated, self.episode)
+        self.count += 1
+        self.shards[-1][1] = self.count
+        self.last_observation = None if terminated else observation
+        return observation, reward, terminated, info
+
+    def _next_shard(self):
+        self._close_shard()
+        name = 'shard-%05d.bin' % len(self.shards)
+        self.records = np.memmap(os.path.join(self.path, name), dtype=RECORD_DTYPE, mode='w+', shape=(self.capacity,))
+        self.count = 0
+        self.shards.append([name, 0])
+        self._write_index()
+
+    def _close_shard(self):
+        if self.records is None:
+            return
+        self.records.flush()
+        self.records = None
+        # drop the unused tail of a shard that was not filled
+        name, count = self.shards[-1]
+        os.truncate(os.path.join(self.path, name), count * RECORD_DTYPE.itemsize)
+
+    def _write_index(self):
+        index = {
+            'dtype': RECORD_DTYPE.descr,
+            'itemsize': RECORD_DTYPE.itemsize,
+            'shards': [{'file': name, 'count': count} for name, count in self.shards],
+        }
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=1)
+
+    def close(self):
+        self._close_shard()
+        self._write_index()
+        super().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class TrajectoryDataset:
+    """
+    Read access to a dataset written by TrajectoryRecorder.
+
+    Shards are memory mapped read only, so nothing is read until it is used
+    and records are returned without copies. dataset[i] is record i over all
+    shards in recording order; records(shard) is a whole shard as one array.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        if index['itemsize'] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"Dataset records are {index['itemsize']} bytes, expected {RECORD_DTYPE.itemsize}")
+        self.path = path
+        self.shards = []
+        for shard in index['shards']:
+            if shard['count']:
+                self.shards.append(np.memmap(os.path.join(path, shard['file']), dtype=RECORD_DTYPE,
+                                             mode='r', shape=(shard['count'],)))
+        # first global index of every shard, and the total at the end
+        self.offsets = np.cumsum([0] + [len(records) for records in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def records(self, shard):
+        return self.shards[shard]
+
+    def locate(self, indices):
+        # (shard, index in shard) of global record indices
+        indices = np.asarray(indices)
+        if indices.size and (indices.min() < -len(self) or indices.max() >= len(self)):
+            raise IndexError(f"Record index out of range for a dataset of {len(self)} records")
+        indices = indices % max(len(self), 1)
+        shards = np.searchsorted(self.offsets, indices, side='right') - 1
+        return shards, indices - self.offsets[shards]
+
+    def __getitem__(self, i):
+        shard, offset = self.locate(i)
+        return self.shards[shard][offset]
+
+    def batch(self, indices):
+        """
+        Gathers records for training.
+
+        Args:
+            indices: Global record indices, in any order.
+
+        Returns:
+            dict: Arrays of the RECORD_DTYPE fields, with the boards unpacked
+            to (len(indices), BOARDWIDTH, BOARDHEIGHT) uint8 occupancy.
+        """
+        shards, offsets = self.locate(indices)
+        records = np.empty(len(shards), dtype=RECORD_DTYPE)
+        for shard in np.unique(shards):
+            selected = shards == shard
+            records[selected] = self.shards[shard][offsets[selected]]
+        batch = {name: records[name] for name in RECORD_DTYPE.names}
+        batch['board'] = unpackBoards(records['board'])
+        return batch
@@ -0,0 +1,208 @@
+import struct
+import time
+import zlib
+
+import gym
+
+from gameLogic import ensureDisplay, checkForQuit
+from bitboard import BOARD_SNAPSHOT_SIZE
+from env import TetrisEnv, SNAPSHOT_STRUCT, BOARD_BACKENDS, ACTION_MODES, PLACEMENT_SEARCHES
+
+# Episode logs: a whole game in a few kilobytes.
+#
+# A game is deterministic given where it starts and the actions taken, so a
+# log holds the seed, the env's snapshot at the start (which includes the
+# piece generator's state) and the actions. Every keyframe_interval actions
+# it also holds a snapshot, so EpisodeReplayer can rebuild any step by
+# restoring the keyframe before it and replaying the actions after it.
+#
+# On disk: LOG_HEADER, then zlib-compressed one byte per action followed by
+# the keyframes, keyframe i being the snapshot after i * keyframe_interval
+# actions.
+
+LOG_MAGIC = b'TLOG'
+LOG_VERSION = 1
+# magic, version, seed (-1 for none), number of actions, keyframe interval,
+# and the indices of the env's backend, action mode and placement search
+LOG_HEADER = struct.Struct('<4sBqIHBBB')
+KEYFRAME_SIZE = SNAPSHOT_STRUCT.size + BOARD_SNAPSHOT_SIZE
+BACKENDS = list(BOARD_BACKENDS)
+
+
+class EpisodeLog:
+    """
+    Seed, actions and keyframes of one game, see EpisodeRecorder.
+
+    Attributes:
+        seed (int): The seed the game was reset with, or None.
+        actions (bytearray): Every action taken, in order.
+        keyframes (list): TetrisEnv.snapshot() after 0, keyframe_interval,
+            2 * keyframe_interval, ... actions.
+        terminated (bool): Whether the game ended after the last action.
+    """
+
+    def __init__(self, seed=None, keyframe_interval=100, backend='bitboard', action_mode='primitive', placement_search='straight'):
+        self.seed = seed
+        self.keyframe_interval = keyframe_interval
+        self.backend = backend
+        self.action_mode = action_mode
+        self.placement_search = placement_search
+        self.actions = bytearray()
+        self.keyframes = []
+        self.terminated = False
+
+    def __len__(self):
+        return len(self.actions)
+
+    def make_env(self, **kwargs):
+        # a TetrisEnv set up like the one the game was played in
+        return TetrisEnv(backend=self.backend, action_mode=self.action_mode,
+                         placement_search=self.placement_search, **kwargs)
+
+    def to_bytes(self):
+        header = LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, -1 if self.seed is None else self.seed,
+                                 len(self.actions), self.keyframe_interval, BACKENDS.index(self.backend),
+                                 ACTION_MODES.index(self.action_mode), PLACEMENT_SEARCHES.index(self.placement_search))
+        return header + zlib.compress(bytes([self.terminated]) + bytes(self.actions) + b''.join(self.keyframes))
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, seed, numActions, interval, backend, actionMode, placementSearch = LOG_HEADER.unpack_from(data)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError("Not an episode log, or one of another version")
+        log = cls(None if seed == -1 else seed, interval, BACKENDS[backend],
+                  ACTION_MODES[actionMode], PLACEMENT_SEARCHES[placementSearch])
+        body = zlib.decompress(data[LOG_HEADER.size:])
+        log.terminated = bool(body[0])
+        log.actions = bytearray(body[1:1 + numActions])
+        frames = body[1 + numActions:]
+        log.keyframes = [frames[i:i + KEYFRAME_SIZE] for i in range(0, len(frames), KEYFRAME_SIZE)]
+        return log
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class EpisodeRecorder(gym.Wrapper):
+    """
+    Logs every game played in the wrapped TetrisEnv. log is the game in
+    progress; a game is moved to logs when it terminates or the env is
+    reset.
+    """
+
+    def __init__(self, env, keyframe_interval=100):
+        super(EpisodeRecorder, self).__init__(env)
+        self.keyframe_interval = keyframe_interval
+        self.log = None
+        self.logs = []
+
+    def reset(self, seed=None, **kwargs):
+        result = self.env.reset(seed=seed, **kwargs)
+        if self.log is not None and len(self.log):
+            self.logs.append(self.log)
+        game = self.env.unwrapped
+        self.log = EpisodeLog(seed, self.keyframe_interval, game.backend, game.action_mode, game.placement_search)
+        self.log.keyframes.append(game.snapshot())
+        return result
+
+    def step(self, action):
+        observation, reward, terminated, info = self.env.step(action)
+        log = self.log
+        log.actions.append(action)
+        if len(log.actions) % log.keyframe_interval == 0:
+            log.keyframes.append(self.env.unwrapped.snapshot())
+        if terminated:
+            log.terminated = True
+            self.logs.append(log)
+            self.log = None
+        return observation, reward, terminated, info
+
+
+class EpisodeReplayer:
+    """
+    Rebuilds the steps of a logged game. Actions are re-simulated with the
+    env's own step(), i.e. TetrisModel.RESULT for primitive actions.
+    """
+
+    def __init__(self, log, env=None):
+        """
+        Args:
+            log (EpisodeLog): The game to replay.
+            env (TetrisEnv, optional): Env to replay in, by default a new one
+                set up like the logged one. Any board backend works.
+        """
+        self.log = log
+        self.env = env if env is not None else log.make_env()
+        self.position = None  # number of actions applied in env
+        self.reward = 0
+        self.terminated = False
+
+    def seek(self, step):
+        """
+        Brings the env to the state after the first step actions, from the
+        nearest keyframe at or before it, or from where the replay is now
+        if that is closer.
+
+        Args:
+            step (int): Number of actions, 0 to len(log).
+
+        Returns:
+            dict: The observation at that step.
+        """
+        log = self.log
+        if not 0 <= step <= len(log):
+            raise IndexError(f"Step {step} is outside the logged game of {len(log)} actions")
+        keyframe = min(step // log.keyframe_interval, len(log.keyframes) - 1)
+        start = keyframe * log.keyframe_interval
+        if self.position is None or not start <= self.position <= step:
+            self.env.restore(log.keyframes[keyframe])
+            self.position = start
+            self.reward = 0
+            self.terminated = False
+        while self.position < step:
+            self.advance()
+        return self.env.observation()
+
+    def advance(self):
+        # apply the next logged action
+        observation, self.reward, self.terminated, info = self.env.step(self.log.actions[self.position])
+        self.position += 1
+        return observation
+
+    def play(self, start=0, stop=None, render=False, delay=0.1):
+        """
+        Replays the game from start to stop, headless at full speed or drawn
+        in the pygame window.
+
+        Args:
+            start (int): Step to start from, see seek().
+            stop (int, optional): Step to stop at, by default the end.
+            render (bool): Draw every step in the window.
+            delay (float): Seconds to wait between drawn steps.
+
+        Yields:
+            tuple: (step, observation, reward, terminated) after every action.
+        """
+        stop = len(self.log) if stop is None else min(stop, len(self.log))
+        observation = self.seek(start)
+        if render:
+            ensureDisplay()
+            self.draw()
+        while self.position < stop:
+            observation = self.advance()
+            if render:
+                checkForQuit()
+                self.draw()
+                time.sleep(delay)
+            yield self.position, observation, self.reward, self.terminated
+
+    def draw(self):
+        state = self.env.state
+        self.env.renderer.draw(state.board, state.falling_piece, state.next_piece,
+                               state.score, state.lines_cleared, state.level)
@@ -1,11 +1,268 @@
 from gameLogic import *
 import random
 import copy
+import time
+from collections import OrderedDict
+import numpy as np
+from bitboard import boardArray, boardKey, boardRows, rowsKey, lineRuns, EMPTY_ROW, FULL_ROW, ROW_BITS, WALL, PIECE_ROW_MASKS
+
+# bit x is set for every pair of neighbouring columns x and x + 1
+NEIGHBOUR_BITS = ROW_BITS >> 1
+
+class featureTracker:
+    """
+    Keeps the nine boardEval.getBoardState features of one board up to date
+    while pieces are added and lines are cleared.
+
+    Column heights, hole counts and column transitions are stored per column,
+    fill counts, row transitions and row masks (see bitboard.BitBoard.rows)
+    per row. Changing the board through the tracker only rescans the columns
+    and rows that were touched.
+    """
+
+    def __init__(self, board):
+        self.board = board
+        # keep the column lists themselves, both board backends edit them in place
+        self.columns = [board[x] for x in range(BOARDWIDTH)]
+        self.heights = [0] * BOARDWIDTH
+        self.holes = [0] * BOARDWIDTH
+        self.colTransitions = [0] * BOARDWIDTH
+        self.rowFill = [0] * BOARDHEIGHT
+        self.rowTransitions = [0] * BOARDHEIGHT
+        self.rowMasks = list(boardRows(board))
+        self.numCompleteLines = 0
+        for x in range(BOARDWIDTH):
+            self.updateColumn(x)
+        for y in range(BOARDHEIGHT):
+            self.updateRow(y)
+
+    def updateColumn(self, x):
+        column = self.columns[x]
+        height = 0
+        for y in range(BOARDHEIGHT):
+            if column[y] != BLANK:
+                height = BOARDHEIGHT - y
+                break
+        holes = 0
+        for y in range(height):  # same rows as boardEval.getNumberOfHoles
+            if column[y] == BLANK:
+                holes += 1
+        transitions = 0
+        above = column[0] == BLANK
+        for y in range(1, BOARDHEIGHT):
+            cell = column[y] == BLANK
+            if cell != above:
+                transitions += 1
+            above = cell
+        self.heights[x] = height
+        self.holes[x] = holes
+        self.colTransitions[x] = transitions
+
+    def updateRow(self, y):
+        # count the row's cells and transitions on its mask, the masks of the
+        # rows covered by a piece are updated before this is called
+        bits = (self.rowMasks[y] >> WALL) & ROW_BITS
+        fill = bits.bit_count()
+        transitions = ((bits ^ (bits >> 1)) & NEIGHBOUR_BITS).bit_count()
+        if self.rowFill[y] == BOARDWIDTH:
+            self.numCompleteLines -= 1
+        if fill == BOARDWIDTH:
+            self.numCompleteLines += 1
+        self.rowFill[y] = fill
+        self.rowTransitions[y] = transitions
+
+    def updatePiece(self, piece):
+        # rescan the columns and rows covered by the piece
+        geometry = PIECE_GEOMETRY[piece['shape']][piece['rotation']]
+        for x, y in geometry.bottom:
+            self.updateColumn(piece['x'] + x)
+        for y in range(geometry.minY, geometry.maxY + 1):
+            self.updateRow(piece['y'] + y)
+
+    def addToBoard(self, piece):
+        addToBoard(self.board, piece)
+        rowMasks = self.rowMasks
+        shift = piece['x'] + WALL
+        for ty, mask in PIECE_ROW_MASKS[piece['shape']][piece['rotation']]:
+            rowMasks[piece['y'] + ty] |= mask << shift
+        self.updatePiece(piece)
+
+    def removeFromBoard(self, piece):
+        removeFromBoard(self.board, piece)
+        rowMasks = self.rowMasks
+        shift = piece['x'] + WALL
+        for ty, mask in PIECE_ROW_MASKS[piece['shape']][piece['rotation']]:
+            rowMasks[piece['y'] + ty] &= ~(mask << shift)
+        self.updatePiece(piece)
+
+    def removeCompleteLines(self):
+        completeRows = [y for y in range(BOARDHEIGHT) if self.rowFill[y] == BOARDWIDTH]
+        if not completeRows:
+            return 0
+        deltas = self.transitionDeltas(completeRows)
+        numLinesRemoved = removeCompleteLines(self.board)
+        self.shiftRows(completeRows, deltas, removed=True)
+        return numLinesRemoved
+
+    def restoreCompleteLines(self, lines):
+        restoreCompleteLines(self.board, lines)
+        lineRows = [y for y, cells in lines]
+        self.shiftRows(lineRows, self.transitionDeltas(lineRows), removed=False)
+
+    def transitionDeltas(self, lineRows):
+        # For every column, how much removing the full rows at lineRows from
+        # the board as it is now changes its column transitions: each run of
+        # line cells is cut out, joining the cells around it, and the blank
+        # rows put on top meet the highest row that is kept.
+        runs = lineRuns(sorted(lineRows))
+        kept = [y for y in range(BOARDHEIGHT) if y not in lineRows]
+        if not kept:
+            return [0] * BOARDWIDTH
+        deltas = []
+        for column in self.columns:
+            delta = int(column[kept[0]] != BLANK)
+            for first, last in runs:
+                if first == 0:
+                    delta -= column[last + 1] == BLANK
+                elif last == BOARDHEIGHT - 1:
+                    delta -= column[first - 1] == BLANK
+                else:
+                    above = column[first - 1] == BLANK
+                    below = column[last + 1] == BLANK
+                    delta += (above != below) - above - below
+            deltas.append(delta)
+        return deltas
+
+    def shiftRows(self, lineRows, deltas, removed):
+        # Move the per-row features along with the rows. A column whose top is
+        # above every line moves with them as a whole, so its height shifts
+        # and its transitions change by deltas (see transitionDeltas); only
+        # its holes are recounted. Other columns are rescanned.
+        n = len(lineRows)
+        if removed:
+            keep = [y for y in range(BOARDHEIGHT) if y not in lineRows]
+            self.rowFill = [0] * n + [self.rowFill[y] for y in keep]
+            self.rowTransitions = [0] * n + [self.rowTransitions[y] for y in keep]
+            self.rowMasks = [EMPTY_ROW] * n + [self.rowMasks[y] for y in keep]
+            self.numCompleteLines -= n
+        else:
+            del self.rowFill[:n]
+            del self.rowTransitions[:n]
+            del self.rowMasks[:n]
+            for y in lineRows:
+                self.rowFill.insert(y, BOARDWIDTH)
+                self.rowTransitions.insert(y, 0)
+                self.rowMasks.insert(y, FULL_ROW)
+            self.numCompleteLines += n
+        firstLine = min(lineRows)
+        for x in range(BOARDWIDTH):
+            height = self.heights[x]
+            if removed:
+                moved = BOARDHEIGHT - height < firstLine
+                height -= n
+            else:
+                moved = height > 0 and BOARDHEIGHT - height - n < firstLine
+                height += n
+            if not moved:
+                self.updateColumn(x)
+                continue
+            top = BOARDHEIGHT - height
+            self.heights[x] = height
+            # same rows as updateColumn, the ones above top are all blank
+            self.holes[x] = min(height, top) + self.columns[x][top:height].count(BLANK)
+            self.colTransitions[x] += deltas[x] if removed else -deltas[x]
+
+    def key(self, piece=None):
+        # boardKey of the board, with piece added if given
+        return rowsKey(self.rowMasks, piece)
+
+    def getBoardState(self):
+        # same values, in the same order, as boardEval.getBoardState
+        heights = self.heights
+        totalColHeight = sum(heights)
+        numPits = heights.count(0)
+        averageColHeight = totalColHeight/BOARDWIDTH
+        bumpiness = 0
+        for x in range(BOARDWIDTH):
+            bumpiness += abs(heights[x] - averageColHeight)
+        numColsWithAtLeastOneHole = BOARDWIDTH - self.holes.count(0)
+
+        deepestWell = 0
+        for x in range(BOARDWIDTH):
+            if x == 0:
+                currentWell = heights[1] - heights[0]
+            elif x == BOARDWIDTH-1:
+                currentWell = heights[x-1] - heights[x]
+            else:
+                currentWell = max(heights[x+1], heights[x-1]) - heights[x]
+            if currentWell > deepestWell:
+                deepestWell = currentWell
+
+        return [self.numCompleteLines, totalColHeight, numPits, bumpiness, sum(self.holes), numColsWithAtLeastOneHole,
+                sum(self.rowTransitions), sum(self.colTransitions), deepestWell]
+
+
+class featureCache:
+    """
+    Bounded LRU cache from boardKey to the nine getBoardState features.
+
+    The features only depend on the board, so one cache can be shared by
+    every brain; only the dot product with the brain is redone on a hit.
+    """
+
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        stateVariables = self.entries.get(key)
+        if stateVariables is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return stateVariables
+
+    def put(self, key, stateVariables):
+        self.entries[key] = stateVariables
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def resize(self, capacity):
+        self.capacity = capacity
+        while len(self.entries) > capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+            "capacity": self.capacity,
+        }
+
+
+# Cache shared by every boardEval unless it is given its own (or None)
+sharedFeatureCache = featureCache()
+
 
 class boardEval:
 
-    def __init__(self, brain):
+    def __init__(self, brain, cache=sharedFeatureCache):
         self.brain = brain
+        self.cache = cache
+        # placements scored and seconds spent by returnBestStateLookahead
+        self.nodes = 0
+        self.searchTime = 0.0
 
     def getColumnHeight(self, board, x):
         for y in range(len(board[x])):
@@ -76,7 +333,16 @@ class boardEval:
         return [numLinesCleared, totalColHeight, numPits, bumpiness, numberOfHoles, numColsWithAtLeastOneHole, rowTransitions, colTransitions, deepestWell]
     
     def evalState(self, board, brain):
-        stateVariables = self.getBoardState(board)
+        if self.cache is None:
+            return self.scoreState(self.getBoardState(board), brain)
+        key = boardKey(board)
+        stateVariables = self.cache.get(key)
+        if stateVariables is None:
+            stateVariables = tuple(self.getBoardState(board))
+            self.cache.put(key, stateVariables)
+        return self.scoreState(stateVariables, brain)
+
+    def scoreState(self, stateVariables, brain):
         score = 0
         for i in range(len(stateVariables)):
             score += stateVariables[i] * brain[i]
@@ -95,6 +361,48 @@ class boardEval:
                 total_score += reward
         return total_score / num_games
 
+    def simulatePlacement(self, board, piece, clearLines=False, tracker=None):
+        """
+        Drops the piece straight down from its position and adds it to the board
+        in place. The piece must be in a valid position.
+
+        Args:
+            board (list): The board to place the piece on, changed in place.
+            piece (dict): The piece to drop, left unchanged.
+            clearLines (bool): Also remove the lines the piece completes.
+            tracker (featureTracker): Tracker of the board to keep up to date.
+
+        Returns:
+            tuple: (landing_y, undo) where undo is handed to undoPlacement to
+                   put the board back the way it was.
+        """
+        placed = piece.copy()
+        placed['y'] = getLandingRow(board, piece)
+        lines = []
+        if tracker is None:
+            addToBoard(board, placed)
+            if clearLines:
+                lines = getCompleteLines(board)
+                if lines:
+                    removeCompleteLines(board)
+        else:
+            tracker.addToBoard(placed)
+            if clearLines and tracker.numCompleteLines:
+                lines = getCompleteLines(board)
+                tracker.removeCompleteLines()
+        return placed['y'], (placed, lines)
+
+    def undoPlacement(self, board, undo, tracker=None):
+        placed, lines = undo
+        if tracker is None:
+            if lines:
+                restoreCompleteLines(board, lines)
+            removeFromBoard(board, placed)
+        else:
+            if lines:
+                tracker.restoreCompleteLines(lines)
+            tracker.removeFromBoard(placed)
+
     def returnBestState(self, piece, board):
         evaluations = {}
         for r in range(len(PIECES[piece['shape']])):  # Try all rotations
@@ -103,31 +411,32 @@ class boardEval:
                 evaluations[(target_x, r)] = self.evalState(simulated_board, self.brain)
         return max(evaluations, key=evaluations.get)  # Return the best move
 
-    def returnBestState(self, piece, board):
+    def getPlacements(self, piece, board):
         """
-        Returns the highest evaluated future state for the given piece and board.
+        Lists the placements returnBestState searches: every rotation and target
+        column the piece can be steered to from its column (one column per row
+        on its way down), dropped straight down from the top row.
 
         Args:
-            piece (dict): The current falling piece.
+            piece (dict): The current falling piece, left unchanged.
             board (list): The current state of the board.
 
         Returns:
-            tuple: (target_x, rotation) representing the best position and rotation.
-                   If no valid state is found, returns a default safe state (0, 0).
+            list: ((target_x, rotation), placed, clean) in search order. placed
+                  is a copy of the piece where it comes to rest. clean is False
+                  when the piece already overlaps the stack at the top row, so
+                  adding it overwrites cells.
         """
-        evaluations = {}
-        bestState = None
-        # print(piece)
+        placements = []
         start_x = piece['x']
-        old_y = piece['y']
+        probe = piece.copy()
 
         for r in range(len(PIECES[piece['shape']])):
-            piece['rotation'] = r
+            probe['rotation'] = r
             for target_x in range(-2, BOARDWIDTH + 2):  # Try placing in all columns
-                newBoard = copy.deepcopy(board)
-                piece['y'] = 0  # Start at the top of the board
-                piece['x'] = start_x
-                if not isValidPosition(board, piece):
+                probe['y'] = 0  # Start at the top of the board
+                probe['x'] = start_x
+                if not isValidPosition(board, probe):
                     continue
 
                 curr_x = start_x
@@ -138,27 +447,86 @@ class boardEval:
                         curr_x += 1
                     else:
                         curr_x -= 1
-                    if not isValidPosition(board, piece, adjY=i, adjX=(curr_x - start_x)):
+                    if not isValidPosition(board, probe, adjY=i, adjX=(curr_x - start_x)):
                         curr_x = target_x + 1  # Invalidate the move
                         break
                 if curr_x != target_x:
                     continue
 
-                piece['x'] = target_x
-                for i in range(1, BOARDHEIGHT):
-                    if not isValidPosition(board, piece, adjY=i):
-                        break
-                piece['y'] += i - 1
+                placed = probe.copy()
+                placed['x'] = target_x
+                clean = isValidPosition(board, placed)
+                if clean:
+                    placed['y'] = getLandingRow(board, placed)
+                else:
+                    for i in range(1, BOARDHEIGHT):
+                        if not isValidPosition(board, placed, adjY=i):
+                            break
+                    placed['y'] += i - 1
+                placements.append(((target_x, r), placed, clean))
+        return placements
+
+    def getPlacementState(self, board, placed, clean, tracker):
+        """
+        Returns the getBoardState features of the board with a placement from
+        getPlacements added, through the feature cache.
 
-                addToBoard(newBoard, piece)
-                evaluations[(target_x, r)] = self.evalState(newBoard, self.brain)
+        Args:
+            board (list): The board, left unchanged.
+            placed (dict): The piece where it comes to rest.
+            clean (bool): As returned by getPlacements.
+            tracker (featureTracker): Tracker of the board.
 
-                if bestState is None or evaluations[(target_x, r)] > evaluations[bestState]:
-                    bestState = (target_x, r)
+        Returns:
+            tuple: The nine features.
+        """
+        if not clean:
+            # Adding the piece would overwrite cells (only happens on a
+            # nearly full board), so read the features from a copy.
+            newBoard = copy.deepcopy(board)
+            addToBoard(newBoard, placed)
+            if self.cache is None:
+                return tuple(self.getBoardState(newBoard))
+            key = boardKey(newBoard)
+            stateVariables = self.cache.get(key)
+            if stateVariables is None:
+                stateVariables = tuple(self.getBoardState(newBoard))
+                self.cache.put(key, stateVariables)
+            return stateVariables
+        stateVariables = None
+        if self.cache is not None:
+            key = tracker.key(placed)
+            stateVariables = self.cache.get(key)
+        if stateVariables is None:
+            # place the piece on the board itself, read the features and take it off again
+            tracker.addToBoard(placed)
+            stateVariables = tuple(tracker.getBoardState())
+            tracker.removeFromBoard(placed)
+            if self.cache is not None:
+                self.cache.put(key, stateVariables)
+        return stateVariables
 
-        # Reset the piece's original state
-        piece['x'] = start_x
-        piece['y'] = old_y
+    def returnBestState(self, piece, board):
+        """
+        Returns the highest evaluated future state for the given piece and board.
+
+        Args:
+            piece (dict): The current falling piece.
+            board (list): The current state of the board.
+
+        Returns:
+            tuple: (target_x, rotation) representing the best position and rotation.
+                   If no valid state is found, returns a default safe state (0, 0).
+        """
+        evaluations = {}
+        bestState = None
+        tracker = featureTracker(board)
+
+        for state, placed, clean in self.getPlacements(piece, board):
+            evaluations[state] = self.scoreState(self.getPlacementState(board, placed, clean, tracker), self.brain)
+
+            if bestState is None or evaluations[state] > evaluations[bestState]:
+                bestState = state
 
         # If no valid move was found, return a default state
         if bestState is None:
@@ -166,13 +534,227 @@ class boardEval:
 
         return bestState
 
+    def returnBestStateLookahead(self, piece, nextPiece, board, beamWidth=4):
+        """
+        Two-ply version of returnBestState. Every placement of the piece is
+        scored, then the beamWidth best ones are played out (clearing their
+        lines) and scored by the best placement of nextPiece after them,
+        plus the lines the first piece cleared. Only placements that fit
+        entirely on the board go into the beam, so all of it is scored by
+        the same two-ply rule; without any, the best one-ply placement is
+        returned.
+
+        Args:
+            piece (dict): The current falling piece.
+            nextPiece (dict): The piece that comes after it.
+            board (list): The current state of the board, left unchanged.
+            beamWidth (int): How many placements of piece to look past.
+
+        Returns:
+            tuple: (target_x, rotation) of the best placement of piece, or
+                   (0, 0) if it has none.
+        """
+        start = time.perf_counter()
+        tracker = featureTracker(board)
+        candidates = []
+        for state, placed, clean in self.getPlacements(piece, board):
+            candidates.append((self.scoreState(self.getPlacementState(board, placed, clean, tracker), self.brain), state, placed, clean))
+        nodes = len(candidates)
+
+        # sorted() is stable, so equal scores stay in search order
+        candidates.sort(key=lambda candidate: -candidate[0])
+        beam = [candidate for candidate in candidates if candidate[3]][:beamWidth]
+        bestState = candidates[0][1] if candidates and not beam else None
+        bestScore = None
+        for score, state, placed, clean in beam:
+            landingY, undo = self.simulatePlacement(board, placed, clearLines=True, tracker=tracker)
+            score = float('-inf')  # nextPiece does not fit: game over
+            for nextState, nextPlaced, nextClean in self.getPlacements(nextPiece, board):
+                stateVariables = self.getPlacementState(board, nextPlaced, nextClean, tracker)
+                score = max(score, self.scoreState(stateVariables, self.brain) + len(undo[1]) * self.brain[0])
+                nodes += 1
+            self.undoPlacement(board, undo, tracker)
+            if bestScore is None or score > bestScore:
+                bestState, bestScore = state, score
+
+        self.nodes += nodes
+        self.searchTime += time.perf_counter() - start
+        if bestState is None:
+            return 0, 0
+        return bestState
+
+    def searchStats(self):
+        # throughput of returnBestStateLookahead so far
+        return {
+            "nodes": self.nodes,
+            "seconds": self.searchTime,
+            "nodes_per_second": self.nodes / self.searchTime if self.searchTime else 0.0,
+        }
+
+    def getBoardStates(self, boards):
+        """
+        Vectorized getBoardState for a stack of boards.
+
+        Args:
+            boards (np.ndarray): (N, BOARDWIDTH, BOARDHEIGHT) bool array, True
+                                 for filled cells.
+
+        Returns:
+            np.ndarray: (N, 9) float array, one getBoardState row per board.
+        """
+        n = len(boards)
+        anyFilled = boards.any(axis=2)
+        heights = np.where(anyFilled, BOARDHEIGHT - boards.argmax(axis=2), 0)
+        numLinesCleared = boards.all(axis=1).sum(axis=1)
+        totalColHeight = heights.sum(axis=1)
+        numPits = (heights == 0).sum(axis=1)
+        averageColHeight = totalColHeight / BOARDWIDTH
+        bumpiness = np.zeros(n)
+        for x in range(BOARDWIDTH):  # summed column by column like getBoardState
+            bumpiness += np.abs(heights[:, x] - averageColHeight)
+        # holes are counted over the same rows as getNumberOfHoles
+        holeRows = np.arange(BOARDHEIGHT)[None, None, :] < heights[:, :, None]
+        holes = (~boards & holeRows).sum(axis=2)
+        rowTransitions = (boards[:, 1:, :] != boards[:, :-1, :]).sum(axis=(1, 2))
+        colTransitions = (boards[:, :, 1:] != boards[:, :, :-1]).sum(axis=(1, 2))
+        neighbours = np.empty_like(heights)
+        neighbours[:, 0] = heights[:, 1]
+        neighbours[:, -1] = heights[:, -2]
+        neighbours[:, 1:-1] = np.maximum(heights[:, :-2], heights[:, 2:])
+        deepestWell = np.maximum((neighbours - heights).max(axis=1), 0)
+        return np.stack([numLinesCleared, totalColHeight, numPits, bumpiness, holes.sum(axis=1),
+                         (holes != 0).sum(axis=1), rowTransitions, colTransitions, deepestWell], axis=1).astype(float)
+
+    def getAfterstates(self, board, placements):
+        """
+        The boards left by placements, stacked for getBoardStates.
+
+        Args:
+            board (list): The board the pieces are placed on, left unchanged.
+            placements (list): As returned by getPlacements.
+
+        Returns:
+            np.ndarray: (len(placements), BOARDWIDTH, BOARDHEIGHT) bool array,
+                        True for filled cells.
+        """
+        filled = boardArray(board) != 0
+        afterstates = np.repeat(filled[None], len(placements), axis=0)
+        index, xs, ys = [], [], []
+        for j, (state, placed, clean) in enumerate(placements):
+            for x, y in PIECE_GEOMETRY[placed['shape']][placed['rotation']].cells:
+                index.append(j)
+                xs.append(placed['x'] + x)
+                ys.append(placed['y'] + y)
+        afterstates[index, xs, ys] = True
+        return afterstates
+
+    def returnBestStateBatched(self, piece, board):
+        """
+        Same search and result as returnBestState, but every afterstate is
+        built into one stacked array and all of them are scored at once with
+        getBoardStates and a single matrix product with the brain.
+        """
+        placements = self.getPlacements(piece, board)
+        if not placements:
+            return 0, 0  # Default fallback state (safe but non-optimal)
+
+        stateVariables = np.empty((len(placements), 9))
+        missing = list(range(len(placements)))
+        if self.cache is not None:
+            rows = boardRows(board)
+            keys = [rowsKey(rows, placed) for state, placed, clean in placements]
+            missing = []
+            for i, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    stateVariables[i] = cached
+
+        if missing:
+            computed = self.getBoardStates(self.getAfterstates(board, [placements[i] for i in missing]))
+            stateVariables[missing] = computed
+            if self.cache is not None:
+                for j, i in enumerate(missing):
+                    self.cache.put(keys[i], tuple(computed[j].tolist()))
+
+        return self.bestPlacements(placements, stateVariables, [self.brain])[0]
+
+    def getPlacementStates(self, piece, board):
+        """
+        The placements returnBestState searches and their features, for
+        scoring against any number of brains, see bestPlacements.
+
+        Args:
+            piece (dict): The current falling piece, left unchanged.
+            board (list): The current state of the board.
+
+        Returns:
+            tuple: (placements, stateVariables), the placements as returned by
+                   getPlacements and a (len(placements), 9) array of features.
+        """
+        placements = self.getPlacements(piece, board)
+        tracker = featureTracker(board)
+        stateVariables = np.array([self.getPlacementState(board, placed, clean, tracker)
+                                   for state, placed, clean in placements], dtype=float)
+        return placements, stateVariables.reshape(len(placements), 9)
+
+    def bestPlacements(self, placements, stateVariables, brains):
+        """
+        Picks the best placement for every brain with one matrix product, with
+        the same result (and tie breaking) as returnBestState for each of them.
+
+        Args:
+            placements (list): As returned by getPlacements.
+            stateVariables (array): Their (len(placements), 9) features.
+            brains: (B, 9) weights, one row per brain.
+
+        Returns:
+            list: (target_x, rotation) for every brain, (0, 0) without placements.
+        """
+        if not placements:
+            return [(0, 0)] * len(brains)  # Default fallback state (safe but non-optimal)
+        brains = np.asarray(brains, dtype=float)
+        scores = stateVariables @ brains.T
+        return [self.bestPlacement(placements, stateVariables, scores[:, b], brains[b]) for b in range(len(brains))]
+
+    def bestPlacement(self, placements, stateVariables, scores, brain):
+        """
+        The placement bestPlacements picks for one brain, from the scores
+        the matrix product gave its placements.
+
+        Args:
+            placements (list): As returned by getPlacements.
+            stateVariables (array): Their (len(placements), 9) features.
+            scores (array): Their (len(placements),) scores under brain.
+            brain: The brain's 9 weights.
+
+        Returns:
+            tuple: (target_x, rotation), (0, 0) without placements.
+        """
+        if not placements:
+            return 0, 0  # Default fallback state (safe but non-optimal)
+        top = scores.max()
+        # The matrix product may round the same features differently from row
+        # to row, so re-score the near-best rows the way evalState does and
+        # keep the first best one, exactly like returnBestState.
+        contenders = np.flatnonzero(scores >= top - 1e-9 * max(1.0, abs(top)))
+        if len(contenders) > 1:
+            brain = np.asarray(brain, dtype=float).tolist()
+            exact = [self.scoreState(stateVariables[i].tolist(), brain) for i in contenders]
+            return placements[int(contenders[exact.index(max(exact))])][0]
+        return placements[int(contenders[0])][0]
+
 
 class gameHandler:
     
-    def __init__(self, piece, board, brain):
-        self.be = boardEval(brain)
+    def __init__(self, piece, board, brain, beamWidth=0, evaluator=None):
+        # evaluator: a boardEval to search with instead of one of brain's own
+        self.be = evaluator if evaluator is not None else boardEval(brain)
         self.piece = piece
         self.board = board
+        # with a beam width, newPiece also looks at the next piece
+        self.beamWidth = beamWidth
 
         self.desiredX, self.desiredRot = self.be.returnBestState(piece, board)
 
@@ -196,12 +778,15 @@ class gameHandler:
         self.desiredX = self.be.returnBestState(self.piece, self.board)[0]
     def setDesiredRot(self):
         self.desiredRot = self.be.returnBestState(self.piece, self.board)[1]
-    def newPiece(self, newPiece, board):
+    def newPiece(self, newPiece, board, nextPiece=None):
         self.piece = newPiece
         self.board = board
         #self.setDesiredX()
         #self.setDesiredRot()
-        self.bestState = self.be.returnBestState(self.piece, self.board)
+        if self.beamWidth and nextPiece is not None:
+            self.bestState = self.be.returnBestStateLookahead(self.piece, nextPiece, self.board, self.beamWidth)
+        else:
+            self.bestState = self.be.returnBestState(self.piece, self.board)
         if self.bestState == None: #No valid moves
             self.bestState = (self.piece['x'], self.piece['rotation'])
         self.desiredX, self.desiredRot = self.bestState
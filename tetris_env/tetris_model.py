@@ -1,9 +1,55 @@
+import time
+
+import numpy as np
 
 from tetrisAI import *
+import gameLogic
+from bitboard import boardArray
+from zobrist import boardHash, pieceHash, nextPieceHash, bagHash
+
+# weights of the built-in planner, see State.gh
+PLANNER_BRAIN = [1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0]
+
+
+def encode_piece(piece, out=None):
+    """
+    Encodes a piece as a small integer array: shape (the color index, see
+    gameLogic.SHAPE_INDEX), rotation, x and y.
+
+    Args:
+        piece (dict): The piece, as made by getNewPiece.
+        out (array, optional): Array to write the first len(out) values into.
+
+    Returns:
+        array: The encoded piece, int8 unless out says otherwise.
+    """
+    values = (SHAPE_INDEX[piece['shape']], piece['rotation'], piece['x'], piece['y'])
+    if out is None:
+        return np.array(values, dtype=np.int8)
+    out[:] = values[:len(out)]
+    return out
+
+
+def decode_piece(encoded):
+    """
+    Turns an encoded piece (see encode_piece) back into a piece dict.
+
+    Args:
+        encoded: shape, rotation, x and y, e.g. an observation's "falling_piece".
+
+    Returns:
+        dict: The piece, as made by getNewPiece.
+    """
+    shape, rotation, x, y = (int(value) for value in encoded)
+    return {'shape': list(PIECES)[shape], 'rotation': rotation, 'x': x, 'y': y, 'color': shape}
+
 
 class State:
-    def __init__(self, board, falling_piece, next_piece, score, level, lines_cleared):
+    def __init__(self, board, falling_piece, next_piece, score, level, lines_cleared, generator=None, beam_width=0,
+                 evaluator=None):
         self.board = board
+        # where new pieces come from, see gameLogic.PieceGenerator
+        self.generator = generator if generator is not None else gameLogic.defaultGenerator
         self.falling_piece = falling_piece
         self.next_piece = next_piece
         self.score = score
@@ -11,8 +57,21 @@ class State:
         self.fall_freq = 0.27
         self.lines_cleared = lines_cleared
         self.last_fall_time = time.time()
-        self.brain = brain=[1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0]
-        self.gh = gameHandler(self.falling_piece, self.board, self.brain)
+        self.brain = PLANNER_BRAIN
+        # with a beam width the planner also looks at the next piece, see gameHandler
+        self.beam_width = beam_width
+        # the boardEval the planner searches with, shared by the states of a
+        # TetrisEnv; without one the planner makes its own
+        self.evaluator = evaluator
+        self._gh = None
+
+    @property
+    def gh(self):
+        # The heuristic planner runs a full placement search, so it is only
+        # built once something (rendering, the built-in bot) asks for it.
+        if self._gh is None:
+            self._gh = gameHandler(self.falling_piece, self.board, self.brain, self.beam_width, self.evaluator)
+        return self._gh
 
     def observation(self):
          return {
@@ -25,21 +84,38 @@ class State:
              "fall_freq": self.fall_freq
          }
 
-    def flatten_observation(self):
-        # Flatten the board into a 1D array
-        observation = self.observation()
-        flat_board = [cell for row in observation["board"] for cell in row]
-
-        # Combine numeric attributes and other relevant info
-        flat_obs = flat_board + [
-            observation["falling_piece"],  # Add falling piece representation
-            observation["next_piece"],  # Add next piece representation
-            observation["score"],
-            observation["level"],
-            observation["lines_cleared"],
-            observation["fall_freq"]
-        ]
-        return flat_obs
+    def flatten_observation(self, out=None):
+        # Flatten the state into one float array: the board cells (see
+        # bitboard.boardArray), the falling and next piece (see encode_piece),
+        # then score, level, lines cleared and fall frequency. out can be a
+        # preallocated array of that length to fill instead.
+        cells = BOARDWIDTH * BOARDHEIGHT
+        if out is None:
+            out = np.empty(cells + 12)
+        out[:cells] = boardArray(self.board).ravel()
+        encode_piece(self.falling_piece, out[cells:cells + 4])
+        encode_piece(self.next_piece, out[cells + 4:cells + 8])
+        out[cells + 8:] = (self.score, self.level, self.lines_cleared, self.fall_freq)
+        return out
+
+    def key(self):
+        """
+        Returns a 64-bit Zobrist key of the position: the filled cells, the
+        falling and next pieces and the pieces left in the generator's bag.
+
+        Returns:
+            int: The key, equal for equal positions.
+        """
+        if self.board.__class__ is list:
+            # a plain list has nowhere to keep a hash, so it is computed here
+            h = boardHash(self.board)
+        else:
+            h = self.board.zobrist  # kept up to date by the board itself
+        if self.falling_piece is not None:
+            h ^= pieceHash(self.falling_piece)
+        if self.next_piece is not None:
+            h ^= nextPieceHash(self.next_piece)
+        return h ^ bagHash(self.generator.bag)
 
     def is_terminal(self):
         """
@@ -65,6 +141,8 @@ class State:
 class TetrisModel:
     def __init__(self, state):
         self.state = state
+        # lines the last advance_game_state cleared, see STEP_COST
+        self.last_lines = 0
     # ACTION keys
     # 0: Left
     # 1: Right
@@ -106,16 +184,18 @@ class TetrisModel:
 
     def advance_game_state(self):
         # Move the piece down
+        self.last_lines = 0
         if isValidPosition(self.state.board, self.state.falling_piece, adjY=1):
             self.state.falling_piece['y'] += 1
         else:
             # Piece has landed
             addToBoard(self.state.board, self.state.falling_piece)
-            self.state.lines_cleared += removeCompleteLines(self.state.board)
+            self.last_lines = removeCompleteLines(self.state.board)
+            self.state.lines_cleared += self.last_lines
             self.state.level, self.state.fall_freq = calculateLevelAndFallFreq(self.state.lines_cleared)
             self.state.score += self.state.lines_cleared * (self.state.level + 1) * 10
             self.state.falling_piece = self.state.next_piece
-            self.state.next_piece = getNewPiece()
+            self.state.next_piece = getNewPiece(self.state.generator)
 
     def RESULT(self, action):
         #print("getting result")
@@ -156,7 +236,7 @@ class TetrisModel:
         self.advance_game_state()
 
         # Create new state object
-        new_state = State(self.state.board, self.state.falling_piece, self.state.next_piece, self.state.score, self.state.level, self.state.lines_cleared)
+        new_state = State(self.state.board, self.state.falling_piece, self.state.next_piece, self.state.score, self.state.level, self.state.lines_cleared, self.state.generator, self.state.beam_width, self.state.evaluator)
 
         return new_state
 
@@ -171,16 +251,15 @@ class TetrisModel:
         return not isValidPosition(self.state.board, self.state.falling_piece)
 
     def STEP_COST(self):
-
-        print("valid actions: ", self.ACTIONS())
         """
         Calculates the reward for the current step:
         - Penalty (-1) for placing a block.
         - Reward (10) for each line cleared.
+
+        The lines are the ones the last advance_game_state cleared, which
+        has already removed them from the board.
         """
-        lines_cleared = removeCompleteLines(self.state.board)
-        # print("lines cleared: ", lines_cleared)
         reward = -1  # Penalty for placing a block
-        if lines_cleared > 0:
-            reward += lines_cleared * 10  # Reward for clearing lines
+        if self.last_lines > 0:
+            reward += self.last_lines * 10  # Reward for clearing lines
         return reward
@@ -0,0 +1,229 @@
+import gym
+import numpy as np
+from gym import spaces
+
+from gameLogic import BOARDWIDTH, BOARDHEIGHT, TEMPLATEWIDTH, PIECES, PIECE_GEOMETRY, SHAPE_INDEX, PieceGenerator
+from frames import renderBoards
+
+# Piece geometry as arrays indexed by [shape, rotation, cell]. Shapes use the
+# PIECES order, which is also the color index used by the scalar game.
+NUM_SHAPES = len(PIECES)
+NUM_ROTATIONS = np.array([len(PIECE_GEOMETRY[shape]) for shape in PIECES], dtype=np.int64)
+CELL_X = np.zeros((NUM_SHAPES, 4, 4), dtype=np.int64)
+CELL_Y = np.zeros((NUM_SHAPES, 4, 4), dtype=np.int64)
+for s, shape in enumerate(PIECES):
+    for r in range(4):
+        cells = PIECE_GEOMETRY[shape][r % len(PIECE_GEOMETRY[shape])].cells
+        CELL_X[s, r] = [x for x, y in cells]
+        CELL_Y[s, r] = [y for x, y in cells]
+
+SPAWN_X = int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2)
+SPAWN_Y = -2
+# pieces pre-generated per board at a time
+QUEUE_LENGTH = 64
+
+
+class TetrisVectorEnv(gym.Env):
+    """
+    Runs num_envs Tetris games side by side with every move applied to all
+    boards at once as NumPy operations.
+
+    Boards live in one (num_envs, BOARDHEIGHT, BOARDWIDTH) int8 array, where 0
+    is an empty cell and color + 1 a filled one. Observations have the keys
+    and layout of TetrisEnv's, stacked: boards indexed [i, x, y] and pieces
+    encoded as by tetris_model.encode_piece. The rules follow
+    TetrisModel.RESULT: the action is applied (0: left, 1: right, 2: rotate
+    clockwise, 3: rotate counter clockwise, 4: hard drop, 5: nothing), then the
+    piece falls one row or lands, full lines are cleared and the next piece
+    spawns. Rewards follow TetrisModel.STEP_COST (-1 per step, +10 per cleared
+    line) and a game ends when the new falling piece does not fit
+    (TetrisModel.GOAL_TEST). Finished games are reset automatically; the last
+    observation of those games is returned in info['final_observation'].
+
+    Every board deals its pieces from its own gameLogic.PieceGenerator. After
+    reset(seed=s), board i gets the same pieces as a TetrisEnv reset with
+    seed s + i.
+
+    With render_mode='rgb_array', render() returns one frame per board, see
+    frames.renderBoards.
+    """
+    metadata = {"render_modes": ["rgb_array"]}
+
+    def __init__(self, num_envs=16, render_mode=None):
+        super(TetrisVectorEnv, self).__init__()
+        if render_mode is not None and render_mode not in self.metadata["render_modes"]:
+            raise ValueError(f"Unknown render mode '{render_mode}', expected one of {self.metadata['render_modes']}")
+        self.num_envs = num_envs
+        self.render_mode = render_mode
+        self.action_space = spaces.MultiDiscrete([6] * num_envs)
+        self.observation_space = spaces.Dict({
+            # the boards indexed [i, x, y], as TetrisEnv's
+            "board": spaces.Box(low=0, high=NUM_SHAPES, shape=(num_envs, BOARDWIDTH, BOARDHEIGHT), dtype=np.int8),
+            # shape, rotation, x and y of the pieces, see tetris_model.encode_piece
+            "falling_piece": spaces.Box(low=-TEMPLATEWIDTH, high=BOARDHEIGHT, shape=(num_envs, 4), dtype=np.int8),
+            "next_piece": spaces.Box(low=-TEMPLATEWIDTH, high=BOARDHEIGHT, shape=(num_envs, 4), dtype=np.int8),
+            "score": spaces.Box(low=0, high=np.inf, shape=(num_envs,), dtype=np.int64),
+            "level": spaces.Box(low=0, high=np.inf, shape=(num_envs,), dtype=np.int64),
+            "lines": spaces.Box(low=0, high=np.inf, shape=(num_envs,), dtype=np.int64),
+        })
+
+        self.boards = np.zeros((num_envs, BOARDHEIGHT, BOARDWIDTH), dtype=np.int8)
+        self.shape = np.zeros(num_envs, dtype=np.int64)
+        self.rotation = np.zeros(num_envs, dtype=np.int64)
+        self.x = np.zeros(num_envs, dtype=np.int64)
+        self.y = np.zeros(num_envs, dtype=np.int64)
+        self.next_shape = np.zeros(num_envs, dtype=np.int64)
+        self.next_rotation = np.zeros(num_envs, dtype=np.int64)
+        self.score = np.zeros(num_envs, dtype=np.int64)
+        self.level = np.zeros(num_envs, dtype=np.int64)
+        self.lines = np.zeros(num_envs, dtype=np.int64)
+        # every board deals its own pieces, pre-generated QUEUE_LENGTH at a time
+        self.generators = [PieceGenerator() for _ in range(num_envs)]
+        self.queue_shape = np.zeros((num_envs, QUEUE_LENGTH), dtype=np.int64)
+        self.queue_rotation = np.zeros((num_envs, QUEUE_LENGTH), dtype=np.int64)
+        self.queue_pos = np.full(num_envs, QUEUE_LENGTH, dtype=np.int64)
+
+    def _new_pieces(self, idx):
+        # Take the next piece from the queue of every board in idx.
+        for i in idx[self.queue_pos[idx] == QUEUE_LENGTH]:
+            pieces = self.generators[i].generate(QUEUE_LENGTH)
+            self.queue_shape[i] = [SHAPE_INDEX[shape] for shape, rotation in pieces]
+            self.queue_rotation[i] = [rotation for shape, rotation in pieces]
+            self.queue_pos[i] = 0
+        pos = self.queue_pos[idx]
+        self.queue_pos[idx] += 1
+        return self.queue_shape[idx, pos], self.queue_rotation[idx, pos]
+
+    def _reset_boards(self, idx):
+        self.boards[idx] = 0
+        self.score[idx] = 0
+        self.level[idx] = 0
+        self.lines[idx] = 0
+        self.shape[idx], self.rotation[idx] = self._new_pieces(idx)
+        self.next_shape[idx], self.next_rotation[idx] = self._new_pieces(idx)
+        self.x[idx] = SPAWN_X
+        self.y[idx] = SPAWN_Y
+
+    def _is_valid(self, idx, rotation, x, y):
+        # Vectorized isValidPosition for the falling pieces of the boards in idx.
+        xs = x[:, None] + CELL_X[self.shape[idx], rotation]
+        ys = y[:, None] + CELL_Y[self.shape[idx], rotation]
+        onBoard = (xs >= 0) & (xs < BOARDWIDTH) & (ys < BOARDHEIGHT)
+        filled = self.boards[idx[:, None], np.clip(ys, 0, BOARDHEIGHT - 1), np.clip(xs, 0, BOARDWIDTH - 1)] != 0
+        # cells above the board never collide
+        return ~((~onBoard | filled) & (ys >= 0)).any(axis=1)
+
+    def _observation(self):
+        return {
+            "board": self.boards.transpose(0, 2, 1).copy(),
+            "falling_piece": np.stack([self.shape, self.rotation, self.x, self.y], axis=1).astype(np.int8),
+            # the next piece waits at the spawn position, as in getNewPiece
+            "next_piece": np.stack([self.next_shape, self.next_rotation, np.full_like(self.x, SPAWN_X),
+                                    np.full_like(self.y, SPAWN_Y)], axis=1).astype(np.int8),
+            "score": self.score.copy(),
+            "level": self.level.copy(),
+            "lines": self.lines.copy(),
+        }
+
+    def reset(self, seed=None, options=None):
+        """
+        Resets every board.
+
+        Returns:
+            tuple: The stacked initial observations and an info dictionary.
+        """
+        super().reset(seed=seed)
+        if seed is not None:
+            for i, generator in enumerate(self.generators):
+                generator.seed(seed + i)
+            self.queue_pos[:] = QUEUE_LENGTH
+        self._reset_boards(np.arange(self.num_envs))
+        return self._observation(), {}
+
+    def step(self, actions):
+        """
+        Applies one action per board.
+
+        Args:
+            actions (array): num_envs action numbers, as in TetrisModel.RESULT.
+
+        Returns:
+            tuple: Stacked observations, rewards, terminations and an info dict.
+        """
+        actions = np.asarray(actions)
+        everyBoard = np.arange(self.num_envs)
+
+        # Sideways moves and rotations only happen when the new position is valid.
+        x = self.x + (actions == 1) - (actions == 0)
+        rotation = (self.rotation + (actions == 2) - (actions == 3)) % NUM_ROTATIONS[self.shape]
+        moved = (actions <= 3) & self._is_valid(everyBoard, rotation, x, self.y)
+        self.x = np.where(moved, x, self.x)
+        self.rotation = np.where(moved, rotation, self.rotation)
+
+        # Hard drop: lower every dropping piece until none of them can move.
+        dropping = everyBoard[actions == 4]
+        while len(dropping):
+            dropping = dropping[self._is_valid(dropping, self.rotation[dropping], self.x[dropping], self.y[dropping] + 1)]
+            self.y[dropping] += 1
+
+        # Gravity: the piece falls one row or lands on the board.
+        falls = self._is_valid(everyBoard, self.rotation, self.x, self.y + 1)
+        self.y[falls] += 1
+        landed = everyBoard[~falls]
+        linesRemoved = np.zeros(self.num_envs, dtype=np.int64)
+        if len(landed):
+            shape = self.shape[landed]
+            xs = self.x[landed, None] + CELL_X[shape, self.rotation[landed]]
+            ys = self.y[landed, None] + CELL_Y[shape, self.rotation[landed]]
+            inside = ys >= 0
+            rows = np.broadcast_to(landed[:, None], xs.shape)
+            self.boards[rows[inside], ys[inside], xs[inside]] = np.broadcast_to(shape[:, None] + 1, xs.shape)[inside]
+
+            # Line clear: move the full rows to the top, keeping the order of
+            # the others, then blank them.
+            boards = self.boards[landed]
+            complete = (boards != 0).all(axis=2)
+            numComplete = complete.sum(axis=1)
+            cleared = numComplete > 0
+            if cleared.any():
+                order = np.argsort(~complete[cleared], axis=1, kind='stable')
+                compacted = np.take_along_axis(boards[cleared], order[:, :, None], axis=1)
+                compacted[np.arange(BOARDHEIGHT)[None, :] < numComplete[cleared, None]] = 0
+                self.boards[landed[cleared]] = compacted
+            linesRemoved[landed] = numComplete
+
+            # Same bookkeeping as TetrisModel.advance_game_state
+            self.lines[landed] += numComplete
+            self.level[landed] = self.lines[landed] // 10
+            self.score[landed] += self.lines[landed] * (self.level[landed] + 1) * 10
+            self.shape[landed] = self.next_shape[landed]
+            self.rotation[landed] = self.next_rotation[landed]
+            self.x[landed] = SPAWN_X
+            self.y[landed] = SPAWN_Y
+            self.next_shape[landed], self.next_rotation[landed] = self._new_pieces(landed)
+
+        rewards = linesRemoved * 10 - 1
+        terminated = ~self._is_valid(everyBoard, self.rotation, self.x, self.y)
+
+        info = {}
+        if terminated.any():
+            info["final_observation"] = self._observation()
+            info["_final_observation"] = terminated
+            self._reset_boards(everyBoard[terminated])
+
+        return self._observation(), rewards, terminated, info
+
+    def render(self):
+        """
+        Renders every board with its falling piece.
+
+        Returns:
+            array: (num_envs, BOARDHEIGHT * BOXSIZE, BOARDWIDTH * BOXSIZE, 3) uint8 frames.
+        """
+        cells = self.boards.copy()
+        xs = self.x[:, None] + CELL_X[self.shape, self.rotation]
+        ys = self.y[:, None] + CELL_Y[self.shape, self.rotation]
+        inside = ys >= 0
+        rows = np.broadcast_to(np.arange(self.num_envs)[:, None], xs.shape)
+        cells[rows[inside], ys[inside], xs[inside]] = np.broadcast_to(self.shape[:, None] + 1, xs.shape)[inside]
+        return renderBoards(cells)
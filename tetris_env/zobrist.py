@@ -0,0 +1,78 @@
+import random
+
+from gameLogic import BOARDWIDTH, BOARDHEIGHT, BLANK, PIECES, PIECE_GEOMETRY
+
+# 64-bit Zobrist keys. They come from a fixed seed so that hashes agree
+# between processes and runs.
+_keys = random.Random(0x7E7215)
+
+
+def _newKey():
+    return _keys.getrandbits(64)
+
+
+# one key per board cell, XORed in while the cell is filled
+CELL_KEYS = [[_newKey() for y in range(BOARDHEIGHT)] for x in range(BOARDWIDTH)]
+
+# XOR of the CELL_KEYS of the filled cells of a row, for any half of the
+# row's columns (bit x of the index is column x of the half), so a whole row
+# of cells is hashed with two lookups, see rowHash
+ROW_HALF = BOARDWIDTH // 2
+ROW_KEYS = []
+for y in range(BOARDHEIGHT):
+    halves = []
+    for first, width in ((0, ROW_HALF), (ROW_HALF, BOARDWIDTH - ROW_HALF)):
+        keys = [0] * (1 << width)
+        for bits in range(1, 1 << width):
+            # the keys without the lowest column, plus that column's key
+            low = (bits & -bits).bit_length() - 1
+            keys[bits] = keys[bits & (bits - 1)] ^ CELL_KEYS[first + low][y]
+        halves.append(keys)
+    ROW_KEYS.append(halves)
+
+# falling piece: shape and rotation, x and y are keyed separately
+PIECE_OFFSET = 8  # lowest x or y a piece can have, negated, with some slack
+FALLING_KEYS = {shape: [_newKey() for rotation in PIECE_GEOMETRY[shape]] for shape in PIECES}
+FALLING_X_KEYS = [_newKey() for x in range(BOARDWIDTH + 2 * PIECE_OFFSET)]
+FALLING_Y_KEYS = [_newKey() for y in range(BOARDHEIGHT + 2 * PIECE_OFFSET)]
+NEXT_KEYS = {shape: [_newKey() for rotation in PIECE_GEOMETRY[shape]] for shape in PIECES}
+# a shape at a given position of the piece bag
+BAG_KEYS = [{shape: _newKey() for shape in PIECES} for i in range(len(PIECES))]
+
+
+def boardHash(board):
+    # Hash of the filled cells of a board, computed from scratch. BitBoard
+    # keeps the same value up to date in board.zobrist.
+    h = 0
+    for x in range(BOARDWIDTH):
+        column = board[x]
+        keys = CELL_KEYS[x]
+        for y in range(BOARDHEIGHT):
+            if column[y] != BLANK:
+                h ^= keys[y]
+    return h
+
+
+def rowHash(y, bits):
+    # hash of the cells of row y whose columns are set in bits (bit x for column x)
+    halves = ROW_KEYS[y]
+    return halves[0][bits & ((1 << ROW_HALF) - 1)] ^ halves[1][bits >> ROW_HALF]
+
+
+def pieceHash(piece):
+    # hash of the falling piece's shape, rotation and position
+    return (FALLING_KEYS[piece['shape']][piece['rotation']]
+            ^ FALLING_X_KEYS[piece['x'] + PIECE_OFFSET]
+            ^ FALLING_Y_KEYS[piece['y'] + PIECE_OFFSET])
+
+
+def nextPieceHash(piece):
+    return NEXT_KEYS[piece['shape']][piece['rotation']]
+
+
+def bagHash(bag):
+    # hash of the shapes still in the piece bag, in draw order
+    h = 0
+    for i, shape in enumerate(bag):
+        h ^= BAG_KEYS[i][shape]
+    return h